@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+"""
+Micro-benchmarks for FileSet (and the other file list storages).
+
+Synthetic path sets are generated for every size, with and without a
+root, and each operation is timed (best of REPEAT runs) and its peak
+and retained memory (held by its result) measured with tracemalloc.
+Results can be saved as a baseline, and compared against one: any
+operation slower (or using more memory) than the baseline by more than
+THRESHOLD is reported as a regression, as is any benchmark missing
+from the baseline, and the exit status is 1.
+
+    python3 bench/bench_FileSet.py --sizes 10000 100000
+    python3 bench/bench_FileSet.py --save bench/baseline_FileSet.json
+
+Baselines are only comparable on the same machine and Python version.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from purrsync import FileSet  # noqa: E402
+from purrsync.__main__ import STORAGE  # noqa: E402
+from purrsync.__main__ import storage as fileList  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline_FileSet.json')
+SIZES = [10000, 100000, 1000000, 5000000]
+# Timing noise, below which slowdowns are not regressions
+MIN_SECONDS = 0.005
+# Allocation noise, below which memory growth is not a regression
+MIN_BYTES = 65536
+PACKAGES = 100
+
+
+def paths(size, rooted=True, seed=0):
+    """
+    Returns size unique synthetic paths, of depth 1 to 12.
+    Rooted paths are absolute (under /), others are relative.
+    """
+    rand = random.Random(seed)
+    prefix = os.sep if rooted else str()
+    result = set()
+    while len(result) < size:
+        depth = rand.randint(1, 12)
+        result.add(prefix + os.sep.join(
+            'd{:x}'.format(rand.randrange(16 * (i + 1)))
+            for i in range(depth - 1)) +
+            (os.sep if depth > 1 else str()) +
+            'f{:x}'.format(rand.randrange(1 << 20)))
+    return sorted(result)
+
+
+def measure(fn, repeat):
+    """
+    Returns (seconds, peak bytes, retained bytes) of fn, the best of
+    repeat runs. Retained bytes are still allocated after fn returns,
+    while its result is kept.
+    """
+    seconds = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if isinstance(seconds, type(None)) or elapsed < seconds:
+            seconds = elapsed
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return seconds, peak, retained
+
+
+def benchmarks(size, rooted, fileset, tmpdir):
+    """ Generates (name, fn) benchmarks for one synthetic path set. """
+    root = os.sep if rooted else None
+    allPaths = paths(size, rooted)
+    half = len(allPaths) // 2
+    # Two overlapping sets, sharing half of their paths.
+    paths1 = allPaths[:half + half // 2]
+    paths2 = allPaths[half // 2:]
+
+    filename = os.path.join(tmpdir, 'filelist')
+    set1 = fileset(setIter=paths1, filename=filename, root=root)
+    set2 = fileset(setIter=paths2, root=root)
+    set1copy = set1.copy()
+    set1.write()
+
+    pkgdir = os.path.join(tmpdir, 'pkg')
+    for i in range(PACKAGES):
+        pkgSet = fileset(setIter=allPaths[i::PACKAGES],
+                         filename=os.path.join(pkgdir, 'cat', str(i)),
+                         root=root)
+        os.makedirs(os.path.dirname(pkgSet.filename), exist_ok=True)
+        pkgSet.write()
+
+    def build():
+        return fileset(setIter=paths1, root=root)
+
+    def read():
+        newSet = fileset(filename=filename, root=root)
+        newSet.read()
+        return newSet
+
+    def fnupdate():
+        newSet = fileset(updatefn=iter(paths1), root=root)
+        newSet.fnupdate()
+        return newSet
+
+    def packageRead():
+        source = FileSet.PackageSource(dirname=pkgdir, root=root,
+                                       fileset=fileset)
+        source.read()
+        return source
+
+    yield ('build', build)
+    yield ('read', read)
+    yield ('write', set1.write)
+    yield ('fnupdate', fnupdate)
+    yield ('union', lambda: set1 | set2)
+    yield ('intersection', lambda: set1 & set2)
+    yield ('difference', lambda: set1 - set2)
+    yield ('eq', lambda: set1 == set1copy)
+    yield ('copy', set1.copy)
+    yield ('PackageSource.read', packageRead)
+
+
+def run(sizes, storage='set', repeat=3, report=print):
+    """ Runs all benchmarks, returns a dict of results by name. """
+    results = dict()
+    for size in sizes:
+        for rooted in [True, False]:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for name, fn in benchmarks(size, rooted, fileList(storage),
+                                           tmpdir):
+                    key = '{}/{}/{}/{}'.format(
+                        storage, name, size, 'root' if rooted else 'noroot')
+                    seconds, peak, retained = measure(fn, repeat)
+                    results[key] = {'seconds': seconds, 'peak': peak,
+                                    'retained': retained}
+                    report('{:<48} {:>10.4f}s {:>12d}B {:>12d}B'.format(
+                        key, seconds, peak, retained))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the regressions of results against baseline, as
+    (name, metric, baseline value, value) tuples, and the names of the
+    results missing from baseline.
+    Slowdowns of less than MIN_SECONDS, and memory growth of less than
+    MIN_BYTES, are ignored.
+    """
+    regressions = list()
+    missing = sorted(set(results) - set(baseline))
+    for name in sorted(set(results) & set(baseline)):
+        for metric in ['seconds', 'peak', 'retained']:
+            if metric not in baseline[name]:
+                missing.append('{} {}'.format(name, metric))
+                continue
+            old, new = baseline[name][metric], results[name][metric]
+            if new - old < (MIN_SECONDS if metric == 'seconds'
+                            else MIN_BYTES):
+                continue
+            if new > old * (1 + threshold):
+                regressions.append((name, metric, old, new))
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='FileSet micro-benchmarks.')
+    parser.add_argument(
+        '--sizes',
+        metavar='SIZE',
+        type=int,
+        nargs='+',
+        default=SIZES,
+        help='Numbers of paths to benchmark.')
+    parser.add_argument(
+        '--storage',
+        metavar='STORAGE',
+        type=str,
+        default='set',
+        choices=sorted(STORAGE),
+        help='File list storage to benchmark, see purrsync --storage.')
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=3,
+        help='Time the best of REPEAT runs.')
+    parser.add_argument(
+        '--baseline',
+        metavar='BASELINE',
+        type=str,
+        default=BASELINE,
+        help='Baseline results to compare against.')
+    parser.add_argument(
+        '--threshold',
+        metavar='THRESHOLD',
+        type=float,
+        default=0.25,
+        help='Allowed slowdown (or memory growth) over the baseline,\n' +
+        'as a fraction (default 0.25).')
+    parser.add_argument(
+        '--save',
+        metavar='FILE',
+        type=str,
+        help='Save the results (merged into FILE) as a baseline.')
+    args = parser.parse_args()
+
+    results = run(args.sizes, storage=args.storage, repeat=args.repeat)
+
+    if args.save:
+        saved = dict()
+        if os.path.isfile(args.save):
+            with open(args.save, 'r') as f:
+                saved = json.load(f)
+        saved.update(results)
+        with open(args.save, 'w') as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        return 0
+
+    baseline = dict()
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions, missing = compare(results, baseline, args.threshold)
+    for name, metric, old, new in regressions:
+        print('regression: {} {} {:.4g} -> {:.4g} ({:+.0%})'.format(
+            name, metric, old, new, new / old - 1 if old else float('inf')))
+    for name in missing:
+        print('no baseline: {}'.format(name))
+    return 1 if regressions or missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+"""
+End-to-end benchmark of the purrsync pipeline.
+
+A synthetic source tree and package layout (package file lists in
+PKG_DIR) are generated, and purrsync.__main__.main is run in-process
+with --rsync-bin pointing at a recording stub, which only reads its
+file list. This measures the overhead of purrsync itself, separately
+from the time spent transferring files. With --real-rsync, the local
+rsync binary is used instead.
+
+Reported are the wall time of each pipeline phase (inclusive, by
+function), the number of processes spawned, the number of rsync runs
+and paths passed to them, and the peak RSS of purrsync and its children.
+The phases recorded by purrsync itself (see --stats) are included, with
+the package transfers summed up as "rsync/pkg/*".
+
+    python3 bench/bench_pipeline.py --files 20000 --packages 1000
+    python3 bench/bench_pipeline.py -j 8 -- --incremental
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import resource
+import tempfile
+import functools
+import subprocess as sp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from purrsync import FileSet  # noqa: E402
+from purrsync import Rsync  # noqa: E402
+from purrsync import Scanner  # noqa: E402
+from purrsync import Manifest  # noqa: E402
+from purrsync import __main__ as purrsync  # noqa: E402
+
+# Functions timed as pipeline phases
+PHASES = [(FileSet.FileSet, 'read'),
+          (FileSet.FileSet, 'fnupdate'),
+          (FileSet.IgnoreSet, 'read'),
+          (FileSet.PackageSource, 'read'),
+          (FileSet.PackageSource, 'fnupdate'),
+          (FileSet.PackageSource, 'mapupdate'),
+          (Scanner, 'scan'),
+          (Manifest.Manifest, 'read'),
+          (Manifest.Manifest, 'write'),
+          (Rsync.Rsync, 'prepareDest'),
+          (Rsync.Rsync, 'rsyncAll')]
+
+# Records the number of paths and arguments of every run
+STUB = """#!/bin/sh
+n=$(wc -l)
+printf '%s\\t%s\\n' "$n" "$*" >> "{log}"
+"""
+
+
+class Phases(dict):
+    def __init__(self):
+        """
+        Initialize Phases
+        Maps phase names to [calls, seconds], see wrap.
+        """
+        self.clear()
+        self.patched = list()
+
+    def wrap(self, owner, name):
+        """
+        Replaces owner.name with a function recording its wall time.
+        Generator functions are timed while they are consumed.
+        """
+        fn = getattr(owner, name)
+        phase = '{}.{}'.format(owner.__name__.split('.')[-1], name)
+        record = self.setdefault(phase, [0, 0.0])
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            record[0] += 1
+            record[1] += time.perf_counter() - start
+            if hasattr(result, '__next__'):
+                return timedIter(result)
+            return result
+
+        def timedIter(result):
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(result)
+                except StopIteration:
+                    return
+                finally:
+                    record[1] += time.perf_counter() - start
+                yield item
+
+        self.patched.append((owner, name, fn))
+        setattr(owner, name, timed)
+
+    def restore(self):
+        for owner, name, fn in reversed(self.patched):
+            setattr(owner, name, fn)
+        self.patched.clear()
+
+
+def generate(tmpdir, files, packages, owned, seed=0):
+    """
+    Generates a source tree of files, a main file list and package file
+    lists in tmpdir. A fraction (owned) of the files belongs to packages,
+    the rest are orphans. Returns (src, mainfile, pkgdir).
+    """
+    rand = random.Random(seed)
+    src = os.path.join(tmpdir, 'src')
+    pkgdir = os.path.join(tmpdir, 'pkg')
+    paths = list()
+    for i in range(files):
+        depth = rand.randint(0, 4)
+        dirname = os.path.join(src, *['d{}'.format(rand.randrange(8))
+                                      for j in range(depth)])
+        os.makedirs(dirname, exist_ok=True)
+        path = os.path.join(dirname, 'f{}'.format(i))
+        with open(path, 'w') as f:
+            f.write(str(i))
+        paths.append(path)
+
+    mainfile = os.path.join(tmpdir, 'main')
+    with open(mainfile, 'w') as f:
+        f.write(os.linesep.join(paths))
+
+    pkgLists = [list() for pkg in range(packages)]
+    for path in paths:
+        if packages and rand.random() < owned:
+            pkgLists[rand.randrange(packages)].append(path)
+    for pkg, pkgList in enumerate(pkgLists):
+        filename = os.path.join(pkgdir, 'cat', 'pkg{}'.format(pkg))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as f:
+            f.write(os.linesep.join(pkgList))
+    return src, mainfile, pkgdir
+
+
+def bench(files=20000, packages=1000, owned=0.8, jobs=1, storage='set',
+          realRsync=False, extraArgs=list()):
+    """ Runs the pipeline once, returns a dict of results. """
+    phases = Phases()
+    spawns = [0]
+    popen = sp.Popen.__init__
+
+    def countedPopen(self, *args, **kwargs):
+        spawns[0] += 1
+        popen(self, *args, **kwargs)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src, mainfile, pkgdir = generate(tmpdir, files, packages, owned)
+        dest = os.path.join(tmpdir, 'dest')
+        os.mkdir(dest)
+
+        log = os.path.join(tmpdir, 'rsync.log')
+        rsyncBin = shutil.which('rsync') if realRsync else None
+        if isinstance(rsyncBin, type(None)):
+            rsyncBin = os.path.join(tmpdir, 'rsync')
+            with open(rsyncBin, 'w') as f:
+                f.write(STUB.format(log=log))
+            os.chmod(rsyncBin, 0o755)
+        open(log, 'w').close()
+        statsfile = os.path.join(tmpdir, 'stats.json')
+
+        argv = ['purrsync', '-p', '-o',
+                '-m', mainfile,
+                '-D', pkgdir,
+                '-j', str(jobs),
+                '--storage', storage,
+                '--stats', statsfile,
+                '-B', rsyncBin] + extraArgs + [src, dest]
+
+        for owner, name in PHASES:
+            phases.wrap(owner, name)
+        sp.Popen.__init__ = countedPopen
+        stdin, sys.argv = sys.stdin, argv
+        sys.stdin = io.TextIOWrapper(io.BytesIO())
+        try:
+            start = time.perf_counter()
+            returncode = purrsync.main()
+            wall = time.perf_counter() - start
+        finally:
+            sys.stdin = stdin
+            sp.Popen.__init__ = popen
+            phases.restore()
+
+        with open(log, 'r') as f:
+            runs = [line.split('\t', 1) for line in f.read().splitlines()]
+        with open(statsfile, 'r') as f:
+            stats = json.load(f)
+
+    return {'returncode': returncode,
+            'wall': wall,
+            'phases': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in phases.items()
+                       if calls},
+            'stats': stats,
+            'spawns': spawns[0],
+            'rsync_runs': len(runs),
+            'rsync_paths': sum(int(n) for n, args in runs),
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'maxrss_children':
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+
+
+def report(results):
+    print('{:<28} {:>8} {:>10}'.format('phase', 'calls', 'seconds'))
+    for name, phase in sorted(results['phases'].items()):
+        print('{:<28} {:>8d} {:>10.4f}'.format(
+            name, phase['calls'], phase['seconds']))
+    print('{:<28} {:>8} {:>10.4f}'.format('total', '', results['wall']))
+
+    phases = dict()
+    for name, phase in results['stats']['phases'].items():
+        if name.startswith('rsync/pkg/'):
+            name = 'rsync/pkg/*'
+        total = phases.setdefault(name, dict.fromkeys(phase, 0))
+        for key, value in phase.items():
+            total[key] += value
+    print()
+    print('{:<28} {:>8} {:>10} {:>10} {:>10}'.format(
+        'purrsync phase', 'calls', 'wall', 'cpu', 'paths'))
+    for name, phase in sorted(phases.items()):
+        print('{:<28} {:>8d} {:>10.4f} {:>10.4f} {:>10d}'.format(
+            name, phase['calls'], phase['wall'], phase['cpu'],
+            phase['paths']))
+    print()
+    print('processes spawned: {}'.format(results['spawns']))
+    if results['rsync_runs']:
+        print('rsync runs: {} ({} paths)'.format(
+            results['rsync_runs'], results['rsync_paths']))
+    print('peak RSS: {} KiB (children {} KiB)'.format(
+        results['maxrss'], results['maxrss_children']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='End-to-end purrsync benchmark.')
+    parser.add_argument(
+        '--files',
+        metavar='FILES',
+        type=int,
+        default=20000,
+        help='Number of files in the source tree.')
+    parser.add_argument(
+        '--packages',
+        metavar='PACKAGES',
+        type=int,
+        default=1000,
+        help='Number of packages.')
+    parser.add_argument(
+        '--owned',
+        metavar='FRACTION',
+        type=float,
+        default=0.8,
+        help='Fraction of files owned by packages, the rest are orphans.')
+    parser.add_argument(
+        '-j', '--jobs',
+        metavar='JOBS',
+        type=int,
+        default=1,
+        help='Passed to purrsync --jobs.')
+    parser.add_argument(
+        '--storage',
+        metavar='STORAGE',
+        type=str,
+        default='set',
+        choices=sorted(purrsync.STORAGE),
+        help='Passed to purrsync --storage.')
+    parser.add_argument(
+        '--real-rsync',
+        action='store_true',
+        help='Use the local rsync binary instead of the recording stub.')
+    parser.add_argument(
+        '--json',
+        metavar='FILE',
+        type=str,
+        help='Write the results to FILE as JSON.')
+    parser.add_argument(
+        'args',
+        metavar='ARGS',
+        nargs=argparse.REMAINDER,
+        help='Further arguments passed to purrsync.')
+    args = parser.parse_args()
+    if args.args[:1] == ['--']:
+        args.args = args.args[1:]
+
+    results = bench(files=args.files,
+                    packages=args.packages,
+                    owned=args.owned,
+                    jobs=args.jobs,
+                    storage=args.storage,
+                    realRsync=args.real_rsync,
+                    extraArgs=args.args)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    return results['returncode']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import time
+import asyncio
+
+from purrsync import FileSet
+from purrsync import Rsync
+from purrsync import Transfer
+
+
+class AsyncRsync(Rsync.Rsync):
+    # Transfer events, see onEvent
+    START = "start"
+    DONE = "done"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+    # Exit code of a transfer which timed out, as rsync's own timeout
+    TIMEOUT_EXIT = 30
+
+    def __init__(self,
+                 *args,
+                 timeout=None,
+                 onOutput=None,
+                 onEvent=None,
+                 **kwargs):
+        """
+        Initialize AsyncRsync
+        Args:
+            timeout (float)     : Seconds after which a transfer is killed,
+        or None.
+            onOutput (function) : Called as onOutput(name, line) for every
+        line rsync writes to stdout, as it is written.
+            onEvent (function)  : Called as onEvent(name, event, transfer)
+        when a transfer starts (transfer is None), and when it is DONE,
+        FAILED, TIMEOUT or CANCELLED.
+
+        Other arguments are those of Rsync. This runs the same transfers
+        as rsyncAll, as asyncio subprocesses: up to `jobs` at once, in a
+        single event loop, without threads. Linked trees are linked in
+        the default executor.
+
+        Every coroutine returns Transfer records, which are also kept in
+        self.transfers. Cancelling a coroutine kills its rsync processes,
+        which are recorded with exit code -1.
+        """
+        Rsync.Rsync.__init__(self, *args, **kwargs)
+        self.timeout = timeout
+        self.onOutput = onOutput
+        self.onEvent = onEvent
+
+    async def rsyncMain(self):
+        """ Rsyncs main set. Returns its Transfer. """
+        transfers = await self.__gather(self.transferList(
+            main=True, package=False, orphan=False))
+        return transfers[self.MAIN]
+
+    async def rsyncPackages(self):
+        """ Rsyncs packages. Returns a dict of pkgName: Transfer. """
+        transfers = await self.__gather(self.transferList(
+            main=False, package=True, orphan=False))
+        return {os.path.relpath(name, self.PACKAGE): transfer
+                for name, transfer in transfers.items()}
+
+    async def rsyncOrphans(self):
+        """ Rsyncs orphaned files. Returns their Transfer. """
+        transfers = await self.__gather(self.transferList(
+            main=False, package=False, orphan=True))
+        return transfers[self.ORPHAN]
+
+    async def rsyncAll(self, main=True, package=True, orphan=True):
+        """
+        Rsyncs main, package and orphan sets concurrently.
+        Returns a dict of name: Transfer, where name is the destination
+        directory relative to DEST.
+        """
+        transfers = dict()
+        if main and self.link:
+            # Linked trees require the main tree first.
+            transfers.update(await self.__gather(self.transferList(
+                main=True, package=False, orphan=False)))
+            main = False
+        transfers.update(await self.__gather(self.transferList(
+            main, package, orphan)))
+        return transfers
+
+    async def __gather(self, transfers):
+        """ Runs (name, setfn, dest) transfers, up to self.jobs at once. """
+        semaphore = asyncio.Semaphore(max(self.jobs, 1))
+
+        async def limited(transfer):
+            async with semaphore:
+                return await self.transfer(*transfer)
+
+        self.prepareTransfers(transfers)
+        results = await asyncio.gather(*[limited(transfer)
+                                         for transfer in transfers])
+        return {transfer['name']: transfer for transfer in results}
+
+    async def transfer(self, name, setfn, dest):
+        """
+        Rsyncs the set returned by setfn into dest, killing rsync after
+        self.timeout seconds. Returns the Transfer, which is recorded
+        in self.transfers[name] (and the exit code in self.returncodes).
+        """
+        self.__event(name, self.START, None)
+        start = time.perf_counter()
+        output = list()
+        event = self.DONE
+        try:
+            with self.stats.phase('rsync/' + name) as counts:
+                returncode = await asyncio.wait_for(
+                    self.__run(name, setfn, dest, counts, output),
+                    self.timeout)
+        except asyncio.TimeoutError:
+            returncode, event = self.TIMEOUT_EXIT, self.TIMEOUT
+            self.returncodes[name] = returncode
+        except asyncio.CancelledError:
+            self.returncodes[name] = -1
+            self.__record(name, -1, start, counts, output, self.CANCELLED)
+            raise
+        if returncode and event == self.DONE:
+            event = self.FAILED
+        return self.__record(name, returncode, start, counts, output, event)
+
+    def __record(self, name, returncode, start, counts, output, event):
+        """ Records the Transfer of name, and reports event. """
+        transfer = Transfer.Transfer(
+            name,
+            returncode=returncode,
+            duration=time.perf_counter() - start,
+            paths=counts['paths'],
+            output=output)
+        self.transfers[name] = transfer
+        self.__event(name, event, transfer)
+        return transfer
+
+    async def __run(self, name, setfn, dest, counts, output):
+        """
+        Runs a transfer, see transfer. The number of paths passed to
+        rsync is set in counts, and its output lines appended to output.
+        Returns the exit code.
+        """
+        syncSet, paths = self.transferPaths(name, setfn, dest)
+
+        if self.link and not name == self.MAIN:
+            loop = asyncio.get_running_loop()
+            proc, counts['paths'] = await loop.run_in_executor(
+                None, self.linkPaths, paths, dest)
+            returncode = proc.returncode
+        elif not isinstance(self.manifest, type(None)) and not paths:
+            # Nothing has changed
+            returncode = 0
+        else:
+            returncode = await self.__rsync(name, paths, dest, counts,
+                                            output)
+
+        self.transferDone(name, returncode, syncSet)
+        return returncode
+
+    async def __rsync(self, name, paths, dest, counts, output):
+        """
+        Runs rsync on paths, streaming its file list and output.
+        Returns the exit code, rsync is killed if cancelled.
+        """
+        stdout = None
+        if self.transferStats or not isinstance(self.onOutput, type(None)):
+            stdout = asyncio.subprocess.PIPE
+        proc = await asyncio.create_subprocess_exec(
+            *self.command("-", self.source, dest),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=stdout)
+        self.stats.spawned()
+
+        reader = None
+        if not isinstance(stdout, type(None)):
+            reader = asyncio.ensure_future(
+                self.__read(name, proc.stdout, output))
+        try:
+            try:
+                for size, data in FileSet.encodeLines(paths,
+                                                      from0=self.from0):
+                    proc.stdin.write(data)
+                    counts['paths'] += size
+                    await proc.stdin.drain()
+                proc.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                # rsync exited early, its exit status is returned below.
+                pass
+            if not isinstance(reader, type(None)):
+                await reader
+            return await proc.wait()
+        finally:
+            if not isinstance(reader, type(None)):
+                reader.cancel()
+            if isinstance(proc.returncode, type(None)):
+                proc.kill()
+                await asyncio.shield(proc.wait())
+
+    async def __read(self, name, stream, output):
+        """ Appends the lines of stream to output, and reports them. """
+        async for line in stream:
+            line = os.fsdecode(line)
+            output.append(line)
+            if not isinstance(self.onOutput, type(None)):
+                self.onOutput(name, line.rstrip(os.linesep))
+
+    def __event(self, name, event, transfer):
+        if not isinstance(self.onEvent, type(None)):
+            self.onEvent(name, event, transfer)
+
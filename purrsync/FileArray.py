@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import bisect
+import operator
+import itertools
+import threading
+
+from purrsync import FileSet
+
+# Size ratio of two lists, above which the smaller list is searched for
+# in the larger, instead of merging them.
+SEARCH = 8
+
+
+class FileArray(FileSet.FileList):
+    SORTED = True
+
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False):
+        """ Initialize FileArray
+        Args: See FileSet.
+
+        A FileArray stores the same canonical keys as a FileSet, in a
+        sorted list without duplicates. Members iterate in sorted order,
+        so write() needs no sort, and membership is a binary search.
+        Set operations between FileArrays are merges of sorted lists
+        (or binary searches, for lists of very different sizes).
+
+        Sorted input, e.g. the output of "find | sort" or a written file
+        list, is loaded as is, without hashing. Paths added one at a time
+        (or in small batches) are kept in a pending list, and merged
+        before the next lookup.
+        """
+        self.__lock = threading.Lock()
+        FileSet.FileList.__init__(self, setIter=setIter, filename=filename,
+                                  updatefn=updatefn, root=root, from0=from0)
+
+    def keys(self):
+        """ Returns the sorted list of canonical keys (not a copy). """
+        self.__flush()
+        return self.__keys
+
+    def updateKeys(self, keys):
+        """
+        Updates the set with canonical keys, without normalization.
+        Large sorted batches are merged, others are added as pending,
+        so that loading key by key (or directory by directory) is not
+        a merge of the whole list per call.
+        """
+        keys = self.__sortedKeys(keys, check=True)
+        if isinstance(keys, type(None)):
+            return
+        if not (self.__keys or self.__pending):
+            self.__keys = keys
+        elif len(keys) * SEARCH < len(self.__keys) + len(self.__pending):
+            self.__pending.extend(keys)
+        else:
+            self.__flush()
+            self.__keys = union(self.__keys, keys)
+
+    def hasKey(self, key):
+        """
+        Returns True if the canonical key is a member, without
+        normalization.
+        """
+        keys = self.keys()
+        i = bisect.bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def discardKeys(self, keys):
+        """
+        Removes canonical keys from the set, without normalization.
+        """
+        keys = self.__sortedKeys(keys)
+        if keys:
+            self.__keys = difference(self.keys(), keys)
+
+    def __sortedKeys(self, keys, check=False):
+        """
+        Returns canonical keys as a sorted list without duplicates.
+        The keys of FileArrays are returned unmodified. If check is set,
+        unsorted keys are added as pending, and None is returned.
+        """
+        if isinstance(keys, FileArray):
+            return keys.keys()
+        keys = list(keys)
+        if isSorted(keys):
+            return keys
+        if check:
+            self.__pending.extend(keys)
+            return None
+        return unique(sorted(keys))
+
+    def __flush(self):
+        """ Merges the pending keys into the sorted keys. """
+        if not self.__pending:
+            return
+        with self.__lock:
+            if self.__pending:
+                pending = unique(sorted(self.__pending))
+                self.__keys = union(self.__keys, pending)
+                self.__pending = list()
+
+    # Set methods
+    def add(self, pathstring):
+        self.__pending.append(self.keyOf(pathstring))
+
+    def clear(self):
+        self.__keys = list()
+        self.__pending = list()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def intersection(self, *others):
+        newSet = self.copy()
+        for s in others:
+            newSet.__keys = intersection(newSet.__keys,
+                                         self.__sortedKeys(self.keysOf(s)))
+        return newSet
+
+    def copy(self):
+        """ Returns a copy of FileArray. """
+        newSet = self.empty()
+        newSet.__keys = list(self.keys())
+        return newSet
+
+    def __eq__(self, other):
+        if isinstance(other, FileArray):
+            return (self.normroot == other.normroot and
+                    self.updatefn == other.updatefn and
+                    self.keys() == other.keys())
+        return FileSet.FileList.__eq__(self, other)
+
+
+def isSorted(keys):
+    """ Returns True if keys is strictly increasing. """
+    return all(map(operator.lt, keys, itertools.islice(keys, 1, None)))
+
+
+def unique(keys):
+    """ Returns sorted keys without (adjacent) duplicates. """
+    return [key for key, _ in itertools.groupby(keys)]
+
+
+def union(a, b):
+    """
+    Returns the union of sorted lists a and b.
+    Sorting the concatenation merges the two runs in linear time.
+    """
+    if not a or not b:
+        return list(a or b)
+    if a[-1] < b[0]:
+        return a + b
+    return unique(sorted(a + b))
+
+
+def intersection(a, b):
+    """
+    Returns the intersection of sorted lists a and b.
+    If one list is much smaller, it is searched for in the other.
+    Otherwise the lists are merged, and keys found twice are kept.
+    """
+    if not a or not b or a[-1] < b[0] or b[-1] < a[0]:
+        return list()
+    if len(b) < len(a):
+        a, b = b, a
+    if len(a) * SEARCH < len(b):
+        return search(a, b)
+    merged = sorted(a + b)
+    return list(itertools.compress(
+        merged, map(operator.eq, merged, itertools.islice(merged, 1, None))))
+
+
+def difference(a, b):
+    """
+    Returns the keys of sorted list a, which are not in sorted list b.
+    Few common keys are cut out of a, otherwise a is merged with the
+    common keys, and keys found once are kept.
+    """
+    if not a or not b or a[-1] < b[0] or b[-1] < a[0]:
+        return list(a)
+    common = intersection(a, b)
+    if len(common) * SEARCH < len(a):
+        result = list()
+        lo = 0
+        for key in common:
+            i = bisect.bisect_left(a, key, lo)
+            result.extend(a[lo:i])
+            lo = i + 1
+        result.extend(a[lo:])
+        return result
+    merged = sorted(a + common)
+    dup = list(map(operator.eq, merged, itertools.islice(merged, 1, None)))
+    return list(itertools.compress(merged, map(
+        operator.not_,
+        map(operator.or_, [False] + dup, dup + [False]))))
+
+
+def search(a, b):
+    """ Returns the keys of sorted list a found in sorted list b. """
+    result = list()
+    lo, end = 0, len(b)
+    for key in a:
+        lo = bisect.bisect_left(b, key, lo)
+        if lo == end:
+            break
+        if b[lo] == key:
+            result.append(key)
+    return result
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import re
+import threading
+
+from purrsync import FileSet
+
+# IDs added to a FileBitmap, above which they are merged into its bits
+PENDING = 65536
+# Runs of non-zero bytes in a bitmap
+NONZERO = re.compile(b'[^\x00]+')
+# Bits set in each byte value
+BYTE_BITS = [tuple(j for j in range(8) if byte >> j & 1)
+             for byte in range(256)]
+# Number of bits set in each byte value
+BYTE_COUNT = bytes(len(bits) for bits in BYTE_BITS)
+
+
+class PathTable:
+    def __init__(self):
+        """
+        Initialize PathTable
+        Assigns each canonical key an integer ID, in order of insertion.
+        Each key is stored once, however many FileBitmaps contain it.
+        A table is shared by passing it to each FileBitmap, e.g. by all
+        file lists of a run, and released with them.
+        """
+        self.keys = list()
+        self.ids = dict()
+        self.lock = threading.Lock()
+
+    def id(self, key):
+        """ Returns the ID of key, adding it if required. """
+        i = self.ids.get(key)
+        if isinstance(i, type(None)):
+            with self.lock:
+                i = self.ids.get(key)
+                if isinstance(i, type(None)):
+                    i = len(self.keys)
+                    self.keys.append(key)
+                    self.ids[key] = i
+        return i
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class FileBitmap(FileSet.FileList):
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False, table=None):
+        """ Initialize FileBitmap
+        Args: See FileSet.
+            table (PathTable): Table of path IDs, by default a new table.
+        FileBitmaps of the same root should share a table.
+
+        A FileBitmap stores the same canonical keys as a FileSet, as a
+        bitmap (an int) of IDs in a PathTable. Set operations between
+        FileBitmaps sharing a table are single int operations. Members
+        iterate in ID order. IDs added are merged into the bitmap in
+        batches, when it is next read. Members are tested against the
+        bytes of the bitmap, cached until it changes.
+        """
+        self.__lock = threading.Lock()
+        self.__bytes = (0, bytes())
+        self.__table = table
+        if isinstance(table, type(None)):
+            self.__table = PathTable()
+        FileSet.FileList.__init__(self, setIter=setIter, filename=filename,
+                                  updatefn=updatefn, root=root, from0=from0)
+
+    @property
+    def table(self):
+        return self.__table
+
+    @property
+    def bits(self):
+        """ The bitmap of IDs, with any pending IDs merged. """
+        if self.__pending:
+            with self.__lock:
+                if self.__pending:
+                    self.__bits |= bitmap(self.__pending)
+                    self.__pending = list()
+        return self.__bits
+
+    @bits.setter
+    def bits(self, bits):
+        self.__pending = list()
+        self.__bits = bits
+
+    def updateKeys(self, keys):
+        """
+        Updates the set with canonical keys, without normalization.
+        """
+        if self.__shares(keys):
+            self.bits |= keys.bits
+            return
+        self.__pending.extend(map(self.__table.id, keys))
+        if len(self.__pending) > PENDING:
+            self.bits
+
+    def hasKey(self, key):
+        """
+        Returns True if the canonical key is a member, without
+        normalization.
+        """
+        i = self.__table.ids.get(key)
+        if isinstance(i, type(None)):
+            return False
+        data = self.__data()
+        byte = i >> 3
+        return byte < len(data) and bool(data[byte] >> (i & 7) & 1)
+
+    def discardKeys(self, keys):
+        """
+        Removes canonical keys from the set, without normalization.
+        """
+        if self.__shares(keys):
+            self.bits &= ~keys.bits
+            return
+        ids = self.__table.ids
+        self.bits &= ~bitmap(ids[key] for key in keys if key in ids)
+
+    def empty(self):
+        """ Returns an empty FileBitmap with the same attributes. """
+        return FileBitmap(filename=None,
+                          updatefn=self.updatefn,
+                          root=self.root,
+                          from0=self.from0,
+                          table=self.__table)
+
+    def __data(self):
+        """ Returns the bitmap as little-endian bytes, cached. """
+        bits = self.bits
+        cache = self.__bytes
+        if cache[0] is not bits:
+            cache = (bits, toBytes(bits))
+            self.__bytes = cache
+        return cache[1]
+
+    def __shares(self, other):
+        """
+        Returns True if other is a FileBitmap of the same table and root,
+        i.e. its bits are IDs of the same keys.
+        """
+        return (isinstance(other, FileBitmap) and
+                self.__table is other.__table and
+                self.normroot == other.normroot)
+
+    # Set methods
+    def clear(self):
+        self.bits = 0
+
+    def __iter__(self):
+        keys = self.__table.keys
+        return (keys[i] for i in members(self.bits))
+
+    def __len__(self):
+        return count(self.bits)
+
+    def intersection(self, *others):
+        newSet = self.copy()
+        for s in others:
+            if self.__shares(s):
+                newSet.bits &= s.bits
+                continue
+            ids = map(self.__table.ids.get, self.keysOf(s))
+            newSet.bits &= bitmap(i for i in ids
+                                  if not isinstance(i, type(None)))
+        return newSet
+
+    def copy(self):
+        """ Returns a copy of FileBitmap. """
+        newSet = self.empty()
+        newSet.bits = self.bits
+        return newSet
+
+    def __eq__(self, other):
+        if self.__shares(other):
+            return (self.updatefn == other.updatefn and
+                    self.bits == other.bits)
+        return FileSet.FileList.__eq__(self, other)
+
+
+def bitmap(ids):
+    """ Returns the bitmap (an int) of an iterable of IDs. """
+    buf = bytearray()
+    for i in ids:
+        byte = i >> 3
+        if byte >= len(buf):
+            buf.extend(bytes(max(byte + 1 - len(buf), len(buf))))
+        buf[byte] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def toBytes(bits):
+    """ Returns a bitmap as little-endian bytes. """
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def count(bits):
+    """ Returns the number of IDs set in a bitmap. """
+    if hasattr(bits, 'bit_count'):
+        return bits.bit_count()
+    return sum(BYTE_COUNT[byte] for byte in toBytes(bits))
+
+
+def members(bits):
+    """
+    Generates the IDs set in a bitmap, in increasing order.
+    Zero bytes are skipped by a regular expression, so sparse bitmaps
+    are not scanned bit by bit.
+    """
+    data = toBytes(bits)
+    for match in NONZERO.finditer(data):
+        for i in range(match.start(), match.end()):
+            base = i << 3
+            for j in BYTE_BITS[data[i]]:
+                yield base + j
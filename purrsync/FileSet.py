@@ -3,140 +3,199 @@
 # Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
 
 import os
-
-
-class FileSet(set):
-    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None):
-        """ Initialize FileSet
-        Args:
-            filename (str): Filename to read/write to.
-            updatefn (method): Command to update filelist.
-            root (str): Root prefix for relative paths.
-
+import json
+import operator
+import itertools
+import threading
+import collections.abc
+import concurrent.futures as cf
+
+from purrsync import Matcher
+
+
+class FileList:
+    # Members iterate in sorted order
+    SORTED = False
+
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False):
+        """ Initialize FileList
+        Args: See FileSet.
+
+        The interface shared by all file list storages (FileSet, FileTrie,
+        FileBitmap and FileArray), implemented on top of the methods of
+        each storage: clear, updateKeys, hasKey, discardKeys, __iter__
+        and __len__ over canonical keys, and copy and intersection.
+        Storages override the other methods where they have faster ways.
         """
-
+        self.from0 = from0
+        self.__root = root
+        self.__normroot = normRoot(root, from0)
         self.clear()
         self.update(setIter)
 
         self.filename = filename
         self.updatefn = updatefn
-        self.root = root
+
+    @property
+    def root(self):
+        return self.__root
+
+    @root.setter
+    def root(self, root):
+        """
+        Sets root, re-keying any existing paths to the new root.
+        """
+        paths = self.normpath() if len(self) else set()
+        self.__root = root
+        self.__normroot = normRoot(root, self.from0)
+        self.clear()
+        self.update(paths)
+
+    @property
+    def normroot(self):
+        """ The normalized root, removed from paths to form keys. """
+        return self.__normroot
 
     def read(self):
         """
         Reads file into set.
+        The file is parsed in chunks straight into the set, so only the
+        set itself is kept in memory. Returns a PathView of the set.
         """
         if not isinstance(self.filename, type(None)):
-            with open(self.filename, 'r') as f:
-                lines = f.read().splitlines()
-                lineset = set(lines)
-            self.update(lineset)
-        return self.normpath()
+            with open(self.filename, 'rb') as f:
+                self.update(readLines(f, self.from0))
+        return self.view()
 
     def write(self):
         """
-        Writes FileSet to filename.
+        Writes the keys to filename, in sorted order.
         """
-        strings = list(self)
-        strings.sort()
-        with open(self.filename, 'w') as f:
-            f.write(os.linesep.join(strings))
+        strings = self
+        if not self.SORTED:
+            strings = sorted(self)
+        if self.from0:
+            with open(self.filename, 'wb') as f:
+                f.write(b'\0'.join(strings))
+        else:
+            with open(self.filename, 'w') as f:
+                f.write(os.linesep.join(strings))
 
     def fnupdate(self):
         """
         Executes the updatefn function to update the list.
         """
-        for i in self.updatefn:
-            if not isinstance(i, str):
-                raise TypeError(
-                    'Output of self.updatefn must be a string! ' +
-                    'Received {} instead!'.format(type(i)))
-            self.add(i)
+        pathtype = bytes if self.from0 else str
+
+        def paths():
+            for i in self.updatefn:
+                if not isinstance(i, pathtype):
+                    raise TypeError(
+                        'Output of self.updatefn must be {}! '.format(
+                            'bytes' if self.from0 else 'a string') +
+                        'Received {} instead!'.format(type(i)))
+                yield i
+        self.update(paths())
         return set(self)
 
     def normpath(self):
         """ Returns the set with normalized paths."""
-        return set({self.__path(item)
-                    for item in self})
+        return set({rootPath(key, self.__normroot)
+                    for key in self})
+
+    def view(self):
+        """ Returns a lazy view of the set with normalized paths. """
+        return PathView(self)
 
-    def __path(self, pathstring):
+    def keyOf(self, pathstring):
         """
-        Returns the filepath joined with root (prefix)
-        If root is None, the pathstring is unmodified.
+        Returns the canonical key of pathstring.
         """
-        if isinstance(self.root, type(None)):
-            return pathstring
-        return os.path.normpath(
-            os.path.join(
-                os.path.normpath(self.root),
-                os.path.normpath(pathstring)))
+        if self.from0 and isinstance(pathstring, str):
+            pathstring = os.fsencode(pathstring)
+        return canonicalPath(pathstring, self.__normroot)
 
-    def __relpath(self, pathstring):
+    def keysOf(self, other):
         """
-        Returns a pathstring after removing root.
-        If root is not present, an error will be raised.
-        If root is None, the pathstring is unmodified.
+        Returns the keys of other, relative to root.
+        File lists sharing the same root are returned unmodified.
         """
-        if isinstance(self.root, type(None)):
-            return pathstring
-
-        norm_root = os.path.normpath(self.root)
-        norm_path = os.path.normpath(pathstring)
-
-        norm_path_ripped = removePrefix(
-            norm_path, norm_root)
-
-        return norm_path_ripped
-
-    # Override Methods
-    def union(self, *others):
-        newSet = self.copy()
+        if not hasattr(other, 'normpath'):
+            return map(self.keyOf, other)
+        if self.__normroot == other.normroot:
+            return other
+        return map(self.keyOf, other.normpath())
+
+    def empty(self):
+        """ Returns an empty file list with the same attributes. """
+        return type(self)(filename=None,
+                          updatefn=self.updatefn,
+                          root=self.root,
+                          from0=self.from0)
+
+    # Set methods
+    def add(self, pathstring):
+        self.updateKeys((self.keyOf(pathstring),))
+
+    def update(self, *others):
         for s in others:
-            newSet.update(
-                set({self.__relpath(i)
-                     for i in s.normpath()}))
-        return newSet
+            self.updateKeys(self.keysOf(s))
+
+    def discard(self, pathstring):
+        try:
+            self.discardKeys((self.keyOf(pathstring),))
+        except ValueError:
+            pass
+
+    def remove(self, pathstring):
+        if pathstring not in self:
+            raise KeyError(pathstring)
+        self.discard(pathstring)
+
+    def __contains__(self, pathstring):
+        try:
+            return self.hasKey(self.keyOf(pathstring))
+        except ValueError:
+            return False
 
-    def intersection(self, *others):
+    def union(self, *others):
         newSet = self.copy()
         for s in others:
-            newSet.intersection_update(
-                set({self.__relpath(i)
-                     for i in s.normpath()}))
+            newSet.updateKeys(self.keysOf(s))
         return newSet
 
     def difference(self, *others):
         newSet = self.copy()
         for s in others:
-            newSet.difference_update(
-                set({self.__relpath(i)
-                     for i in s.normpath()}))
+            newSet.discardKeys(self.keysOf(s))
+        for s in others:
+            if isinstance(s, IgnoreSet):
+                s.prune(newSet)
         return newSet
 
-    def copy(self):
-        """ Returns a copy of FileSet. """
-        return FileSet(setIter=self.__set__(),
-                       filename=None,
-                       updatefn=self.updatefn,
-                       root=self.root)
-
     def __eq__(self, other):
-        if (self.root == other.root and
-                self.updatefn == other.updatefn and
-                self.__set__() == other.__set__()):
-            return True
-        else:
+        """
+        Returns True if other is a file list with the same root, updatefn
+        and keys, whatever its storage.
+        """
+        if not hasattr(other, 'normpath'):
             return False
+        if not (self.__normroot == getattr(other, 'normroot', None) and
+                self.updatefn == getattr(other, 'updatefn', None)):
+            return False
+        if not len(self) == len(other):
+            return False
+        if self.SORTED and getattr(other, 'SORTED', False):
+            return all(map(operator.eq, self, other))
+        return all(map(other.hasKey, self))
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __set__(self):
-        """ Returns a plain set of FileSet. """
-        return set({
-            self.__relpath(
-                self.__path(item))
-            for item in self})
+        """ Returns a plain set of the keys. """
+        return set(self)
 
     def __or__(self, other):
         return self.union(other)
@@ -148,12 +207,218 @@ class FileSet(set):
         return self.difference(other)
 
 
+class FileSet(FileList, set):
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False):
+        """ Initialize FileSet
+        Args:
+            filename (str): Filename to read/write to.
+            updatefn (method): Command to update filelist.
+            root (str): Root prefix for relative paths.
+            from0 (bool): Paths are bytes, files are NUL-delimited.
+
+        Paths are stored as canonical keys, i.e. normalized and relative
+        to root, so that set algebra between FileSets is performed on
+        plain strings.
+        """
+        FileList.__init__(self, setIter=setIter, filename=filename,
+                          updatefn=updatefn, root=root, from0=from0)
+
+    def updateKeys(self, keys):
+        """
+        Updates the set with canonical keys, without normalization.
+        Keys must already be relative to root (see keyOf).
+        """
+        set.update(self, keys)
+
+    def hasKey(self, key):
+        """
+        Returns True if the canonical key is a member, without
+        normalization.
+        """
+        return set.__contains__(self, key)
+
+    def discardKeys(self, keys):
+        """
+        Removes canonical keys from the set, without normalization.
+        """
+        set.difference_update(self, keys)
+
+    # Override Methods
+    def add(self, pathstring):
+        set.add(self, self.keyOf(pathstring))
+
+    def update(self, *others):
+        for s in others:
+            if (isinstance(self.normroot, type(None)) and
+                    not hasattr(s, 'normpath')):
+                set.update(self, s)
+            else:
+                set.update(self, self.keysOf(s))
+
+    def __contains__(self, pathstring):
+        try:
+            return set.__contains__(self, self.keyOf(pathstring))
+        except ValueError:
+            return False
+
+    def union(self, *others):
+        newSet = self.copy()
+        set.update(newSet,
+                   *[self.keysOf(s) for s in others])
+        return newSet
+
+    def intersection(self, *others):
+        newSet = self.empty()
+        set.update(newSet,
+                   set.intersection(
+                       self,
+                       *[self.keysOf(s) for s in others]))
+        return newSet
+
+    def difference(self, *others):
+        newSet = self.copy()
+        set.difference_update(newSet,
+                              *[self.keysOf(s) for s in others])
+        for s in others:
+            if isinstance(s, IgnoreSet):
+                s.prune(newSet)
+        return newSet
+
+    def copy(self):
+        """ Returns a copy of FileSet. """
+        newSet = self.empty()
+        set.update(newSet, self)
+        return newSet
+
+    def __eq__(self, other):
+        if isinstance(other, set) and hasattr(other, 'normpath'):
+            return (self.normroot == other.normroot and
+                    self.updatefn == other.updatefn and
+                    set.__eq__(self, other))
+        return FileList.__eq__(self, other)
+
+
+class IgnoreSet(FileSet):
+    # Rule prefixes in the ignore file
+    GLOB = "glob:"
+    REGEX = "re:"
+
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False):
+        """ Initialize IgnoreSet
+        Args: See FileSet.
+
+        Besides paths, the ignore file may contain rules:
+            glob:PATTERN : Ignores paths matching a glob pattern.
+            re:REGEX     : Ignores paths matching a regular expression.
+            DIRECTORY/   : Ignores a directory and everything below it.
+        Rules match keys (paths relative to root), see Matcher. Directories
+        outside root are skipped.
+        They are applied when an IgnoreSet is subtracted from a FileSet.
+        """
+        self.rules = list()
+        self.__matcher = None
+        FileSet.__init__(self, setIter=setIter, filename=filename,
+                         updatefn=updatefn, root=root, from0=from0)
+
+    def read(self):
+        """
+        Reads file into set, separating rules from paths.
+        Paths are streamed into the set as the file is parsed.
+        """
+        if not isinstance(self.filename, type(None)):
+            with open(self.filename, 'rb') as f:
+                self.update(line for line in readLines(f, self.from0)
+                            if not self.addRule(line))
+        return self.view()
+
+    def addRule(self, line):
+        """
+        Adds line as a rule. Returns False if line is a plain path.
+        """
+        glob, regex, sep = self.GLOB, self.REGEX, os.sep
+        if self.from0:
+            glob, regex, sep = map(os.fsencode, (glob, regex, sep))
+        if not (line.startswith(glob) or line.startswith(regex) or
+                line.endswith(sep)):
+            return False
+        self.rules.append(line)
+        self.__matcher = None
+        return True
+
+    def matcher(self):
+        """ Returns the rules compiled for the current root. """
+        if (isinstance(self.__matcher, type(None)) or
+                not self.__matcher[0] == self.normroot):
+            self.__matcher = (self.normroot, self.__compile())
+        return self.__matcher[1]
+
+    def prunes(self, pathstring):
+        """
+        Returns True if pathstring is a directory, or below a directory,
+        ignored by a rule. Paths outside root are never pruned.
+        """
+        try:
+            key = canonicalPath(pathstring, self.normroot)
+        except ValueError:
+            return False
+        return self.matcher().prunes(key)
+
+    def prune(self, fileset):
+        """
+        Removes the paths matching any rule from fileset, in one pass.
+        """
+        matcher = self.matcher()
+        if not matcher:
+            return fileset
+        if fileset.normroot == self.normroot:
+            matched = [key for key in fileset if matcher.match(key)]
+        else:
+            matched = list()
+            for key in fileset:
+                try:
+                    path = canonicalPath(rootPath(key, fileset.normroot),
+                                         self.normroot)
+                except ValueError:
+                    continue
+                if matcher.match(path):
+                    matched.append(key)
+        fileset.discardKeys(matched)
+        return fileset
+
+    def __compile(self):
+        glob, regex = self.GLOB, self.REGEX
+        if self.from0:
+            glob, regex = os.fsencode(glob), os.fsencode(regex)
+        matcher = Matcher.Matcher(from0=self.from0)
+        for rule in self.rules:
+            if rule.startswith(glob):
+                matcher.addGlob(rule[len(glob):])
+            elif rule.startswith(regex):
+                matcher.addRegex(rule[len(regex):])
+            else:
+                # Directories outside root cannot match any key.
+                try:
+                    matcher.addDir(canonicalPath(rule, self.normroot))
+                except ValueError:
+                    continue
+        return matcher
+
+
 class PackageSource(dict):
+    # Fingerprint cache, stored in dirname
+    FINGERPRINTS = ".purrsync-fingerprints"
+
     def __init__(self,
                  pkglist=list(),
                  dirname=None,
                  pkgfn=None,
-                 root=None):
+                 root=None,
+                 from0=False,
+                 jobs=1,
+                 keyfn=None,
+                 fileset=FileSet):
         """
         Initialize PackageSource
         Args:
@@ -162,12 +427,34 @@ class PackageSource(dict):
             pkgfn (method) : A function returning an iterable for a package.
         I.e. updatefn=pkgfn(package)
             root (str)     : Root prefix for relative paths.
+            from0 (bool)   : Package file lists are NUL-delimited bytes.
+            jobs (int)     : Number of packages to update concurrently.
+            keyfn (method) : A function returning a fingerprint for a package.
+            fileset (class): The FileSet class used for package file lists,
+        e.g. FileTrie.
+
+        If keyfn, pkgfn and dirname are given, dirname is used as a cache.
+        Package file lists are written to dirname with their fingerprint,
+        and pkgfn is only used for packages whose fingerprint changed.
+        Packages updated from a package map (see mapupdate) are not
+        updated with pkgfn.
+
+        An index of path ownership (key -> package name, or a set of
+        package names for shared paths) is kept up to date as packages are
+        added, read and updated.
         """
         self.clear()
         self.pkglist = pkglist
         self.dirname = dirname
         self.pkgfn = pkgfn
         self.root = root
+        self.from0 = from0
+        self.jobs = jobs
+        self.keyfn = keyfn
+        self.fileset = fileset
+        self.fingerprints = dict()
+        self.pathIndex = dict()
+        self.mapped = set()
 
         # Initialize dict
         for pkg in pkglist:
@@ -175,7 +462,9 @@ class PackageSource(dict):
 
     def add(self, pkg):
         root = self.root
-        updatefn = self.pkgfn(pkg)
+        updatefn = list()
+        if not isinstance(self.pkgfn, type(None)):
+            updatefn = self.pkgfn(pkg)
 
         if isinstance(self.dirname, type(None)):
             dirname = "."
@@ -183,18 +472,25 @@ class PackageSource(dict):
             dirname = self.dirname
         filename = os.path.join(dirname, pkg)
 
-        self[pkg] = FileSet(filename=filename,
-                            updatefn=updatefn,
-                            root=root)
+        if pkg in self:
+            self.__unindex(pkg)
+        self.mapped.discard(pkg)
+        self[pkg] = self.fileset(filename=filename,
+                                 updatefn=updatefn,
+                                 root=root,
+                                 from0=self.from0)
         return self[pkg]
 
     def remove(self, pkg):
+        self.__unindex(pkg)
+        self.mapped.discard(pkg)
         return self.pop(pkg)
 
     def read(self):
         """
         Reads packages from directory.
         All files in dirname are considered to be packages file lists.
+        In cache mode, only lists of known packages are read.
 
         """
         if not isinstance(self.dirname, type(None)):
@@ -203,29 +499,369 @@ class PackageSource(dict):
                 for name in filenames:
                     fullname = os.path.join(dirpath, name)
                     name_ripped = removePrefix(fullname, self.dirname)
-                    if name_ripped not in self:
+                    if name_ripped == self.FINGERPRINTS:
+                        continue
+                    if name_ripped not in self and not self.isCache():
                         self.add(name_ripped)
 
             # Read package data
-            for pkgSet in self.values():
-                pkgSet.read()
+            for pkg, pkgSet in self.items():
+                if os.path.isfile(pkgSet.filename):
+                    pkgSet.read()
+                    self.__index(pkg)
+
+            if self.isCache():
+                fingerprints = os.path.join(self.dirname, self.FINGERPRINTS)
+                if os.path.isfile(fingerprints):
+                    with open(fingerprints, 'r') as f:
+                        self.fingerprints = json.load(f)
 
     def fnupdate(self):
-        # Update packages
-        for pkgSet in self.values():
+        """
+        Updates packages with their updatefn, except for packages from a
+        package map. Up to self.jobs packages are updated concurrently.
+        In cache mode, only packages with a changed fingerprint are updated
+        and their file lists are written back to dirname. Cached lists are
+        relative to root and delimited by newlines or NUL, so the
+        fingerprint includes the root and from0. The lists of packages
+        without a fingerprint any more are removed.
+        """
+        fingerprints = dict()
+        lock = threading.Lock()
+
+        def update(pkg):
+            pkgSet = self[pkg]
+            if not self.isCache():
+                size = len(pkgSet)
+                pkgSet.fnupdate()
+                if not len(pkgSet) == size:
+                    with lock:
+                        self.__index(pkg)
+                return
+
+            fingerprint = self.__fingerprint(pkg)
+            fingerprints[pkg] = fingerprint
+            if (fingerprint == self.fingerprints.get(pkg) and
+                    os.path.isfile(pkgSet.filename)):
+                return
+            with lock:
+                self.__unindex(pkg)
+            pkgSet.clear()
             pkgSet.fnupdate()
+            with lock:
+                self.__index(pkg)
+            os.makedirs(os.path.dirname(pkgSet.filename), exist_ok=True)
+            pkgSet.write()
+
+        pkgs = [pkg for pkg in self if pkg not in self.mapped]
+        if self.jobs <= 1:
+            for pkg in pkgs:
+                update(pkg)
+        else:
+            with cf.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for result in executor.map(update, pkgs):
+                    pass
+
+        if self.isCache():
+            # Lists of packages no longer cached would be read as
+            # packages by read, outside cache mode.
+            for pkg in set(self.fingerprints).difference(fingerprints):
+                filename = os.path.join(self.dirname, pkg)
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            self.fingerprints = fingerprints
+            with open(os.path.join(self.dirname, self.FINGERPRINTS),
+                      'w') as f:
+                json.dump(fingerprints, f, indent=0, sort_keys=True)
+
+    def mapupdate(self, pairs):
+        """
+        Updates packages from (package, path) pairs, adding packages as
+        required. Paths outside root are skipped. See parseMap.
+        These packages are no longer updated by fnupdate.
+        """
+        normroot = self.normroot
+        pkgName = None
+        for name, path in pairs:
+            try:
+                key = canonicalPath(path, normroot)
+            except ValueError:
+                continue
+            if not name == pkgName:
+                if name not in self:
+                    self.add(name)
+                self.mapped.add(name)
+                pkgName, pkgSet = name, self[name]
+            pkgSet.updateKeys((key,))
+            self.__own(key, name)
+
+    @property
+    def normroot(self):
+        """ The normalized root, removed from paths to form keys. """
+        return normRoot(self.root, self.from0)
+
+    def isCache(self):
+        """ Returns True if dirname is used as a package list cache. """
+        return not (isinstance(self.keyfn, type(None)) or
+                    isinstance(self.pkgfn, type(None)) or
+                    isinstance(self.dirname, type(None)))
+
+    def reindex(self):
+        """
+        Rebuilds the path ownership index from all packages.
+        Only required if package sets are modified directly.
+        """
+        self.pathIndex.clear()
+        for pkg in self:
+            self.__index(pkg)
+
+    def owners(self, pathstring):
+        """ Returns the set of packages owning pathstring. """
+        if self.from0 and isinstance(pathstring, str):
+            pathstring = os.fsencode(pathstring)
+        try:
+            key = canonicalPath(pathstring, self.normroot)
+        except ValueError:
+            return set()
+        owners = self.pathIndex.get(key)
+        if isinstance(owners, type(None)):
+            return set()
+        if isinstance(owners, set):
+            return set(owners)
+        return set({owners})
+
+    def shared(self):
+        """ Returns a dict of paths owned by more than one package. """
+        return {rootPath(key, self.normroot): set(pkgs)
+                for key, pkgs in self.pathIndex.items()
+                if isinstance(pkgs, set)}
+
+    def ownedSet(self):
+        """ Returns a FileSet of all packaged paths. """
+        ownedSet = self.fileset(root=self.root, from0=self.from0)
+        ownedSet.updateKeys(self.pathIndex)
+        return ownedSet
+
+    def __fingerprint(self, pkg):
+        """
+        Returns the fingerprint of pkg, with the root its cached file list
+        is relative to and its delimiter, as stored in FINGERPRINTS.
+        """
+        normroot = self.normroot
+        if not isinstance(normroot, type(None)):
+            normroot = os.fsdecode(normroot)
+        return [normroot, self.from0, self.keyfn(pkg)]
+
+    def __own(self, key, pkg):
+        """
+        Adds pkg to the owners of key. A single owner is stored as is,
+        and promoted to a set of owners on a second owner.
+        """
+        owners = self.pathIndex.setdefault(key, pkg)
+        if owners == pkg:
+            return
+        if isinstance(owners, set):
+            owners.add(pkg)
+        else:
+            self.pathIndex[key] = set({owners, pkg})
+
+    def __index(self, pkg):
+        for key in self[pkg]:
+            self.__own(key, pkg)
+
+    def __unindex(self, pkg):
+        for key in self[pkg]:
+            owners = self.pathIndex.get(key)
+            if isinstance(owners, set):
+                owners.discard(pkg)
+                if len(owners) == 1:
+                    self.pathIndex[key] = owners.pop()
+            elif owners == pkg:
+                del self.pathIndex[key]
+
+
+class PathView(collections.abc.Set):
+    def __init__(self, fileset):
+        """
+        Initialize PathView
+        Args:
+            fileset (FileSet): A file list, or any set of canonical keys
+        with a normroot.
+
+        A read-only set of the normalized paths of fileset, i.e. its keys
+        joined with root, as returned by normpath. Nothing is copied:
+        paths are generated when iterating, membership is tested against
+        fileset, and the view follows changes to fileset.
+        """
+        self.fileset = fileset
+
+    def __iter__(self):
+        normroot = self.fileset.normroot
+        if isinstance(normroot, type(None)):
+            return iter(self.fileset)
+        return (rootPath(key, normroot) for key in self.fileset)
+
+    def __contains__(self, pathstring):
+        return pathstring in self.fileset
+
+    def __len__(self):
+        return len(self.fileset)
+
+    @classmethod
+    def _from_iterable(cls, it):
+        # Results of set operators are plain sets.
+        return set(it)
+
+
+def writeLines(stream, paths, chunksize=4096, from0=False):
+    """
+    Writes paths to a binary stream incrementally, one per line.
+    Paths are written in iteration order, chunksize paths at a time.
+    If from0 is set, paths are bytes and are NUL-terminated instead.
+    Returns the number of paths written.
+    """
+    count = 0
+    for size, data in encodeLines(paths, chunksize, from0):
+        count += size
+        stream.write(data)
+    return count
+
+
+def encodeLines(paths, chunksize=4096, from0=False):
+    """
+    Generates (number of paths, bytes) chunks of paths, as written by
+    writeLines. Used where the stream is not a file, e.g. asyncio.
+    """
+    paths = iter(paths)
+    while True:
+        chunk = list(itertools.islice(paths, chunksize))
+        if not chunk:
+            break
+        size = len(chunk)
+        if from0:
+            chunk.append(bytes())
+            yield size, b'\0'.join(chunk)
+        else:
+            chunk.append(str())
+            yield size, os.fsencode(os.linesep.join(chunk))
+
+
+def readLines(stream, from0=False, chunksize=65536):
+    """
+    Generates paths from a binary stream incrementally.
+    Paths are separated by newlines and decoded, or if from0 is set,
+    separated by NUL and left as bytes. Empty paths are skipped.
+    """
+    sep = b'\0' if from0 else os.fsencode(os.linesep)
+    read = getattr(stream, 'read1', stream.read)
+    tail = bytes()
+    while True:
+        chunk = read(chunksize)
+        if not chunk:
+            break
+        chunk = tail + chunk
+        end = chunk.rfind(sep)
+        if end < 0:
+            tail = chunk
+            continue
+        tail = chunk[end + len(sep):]
+        if from0:
+            items = chunk[:end].split(sep)
+        else:
+            items = os.fsdecode(chunk[:end]).split(os.linesep)
+        for item in items:
+            if item:
+                yield item
+    if tail:
+        yield tail if from0 else os.fsdecode(tail)
+
+
+def parseMap(lines):
+    """
+    Generates (package, path) pairs from "package path" lines, or from
+    "package, package: path" lines as printed by "dpkg -S", which yield
+    a pair per package. Diversion lines of "dpkg -S" are skipped.
+    Package names are always decoded, paths are left as given.
+    Lines without a path are skipped.
+    """
+    for line in lines:
+        fields = line.split(None, 1)
+        if not len(fields) == 2:
+            continue
+        sep, comma, diversions = ': ', ',', ('diversion by ',
+                                              'local diversion ')
+        if isinstance(line, bytes):
+            sep, comma = os.fsencode(sep), os.fsencode(comma)
+            diversions = tuple(map(os.fsencode, diversions))
+        if line.startswith(diversions):
+            continue
+        if not fields[0][-1:] in (sep[:1], comma):
+            yield (os.fsdecode(fields[0]), fields[1])
+            continue
+        pkgs, _, path = line.partition(sep)
+        if not path:
+            continue
+        for pkg in pkgs.split(comma):
+            pkg = os.fsdecode(pkg).strip()
+            if pkg:
+                yield (pkg, path)
+
+
+def normRoot(root, from0=False):
+    """
+    Returns the normalized root, as bytes if from0 is set.
+    If root is None, None is returned.
+    """
+    if isinstance(root, type(None)):
+        return None
+    if from0:
+        return os.fsencode(os.path.normpath(root))
+    return os.path.normpath(root)
+
+
+def canonicalPath(pathstring, root):
+    """
+    Returns the canonical key of pathstring.
+    The path is normalized and the (normalized) root is removed.
+    If root is not present, an error will be raised.
+    If root is None, the pathstring is unmodified.
+    """
+    if isinstance(root, type(None)):
+        return pathstring
+
+    norm_path = os.path.normpath(
+        os.path.join(root, pathstring))
+
+    return removePrefix(norm_path, root)
+
+
+def rootPath(key, root):
+    """
+    Returns the canonical key joined with the (normalized) root.
+    If root is None, the key is unmodified.
+    """
+    if isinstance(root, type(None)):
+        return key
+    return os.path.normpath(
+        os.path.join(root, key))
 
 
 def removePrefix(pathstring, root):
-    if pathstring.startswith(root):
-        # Trailing slash
-        if not root[-1] == os.sep:
-            root += os.sep
+    sep, curdir = os.sep, os.curdir
+    if isinstance(root, bytes):
+        sep, curdir = os.fsencode(sep), os.fsencode(curdir)
+    prefix = root
+    # Trailing slash
+    if not prefix[-1:] == sep:
+        prefix += sep
+    if pathstring == root:
         return pathstring[len(root):]
-    elif root == os.sep:
+    elif pathstring.startswith(prefix):
+        return pathstring[len(prefix):]
+    elif root == sep:
         # Exception for absroot
         return pathstring
-    elif root == ".":
+    elif root == curdir:
         # Exception for relative paths.
         return pathstring
     else:
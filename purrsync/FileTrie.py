@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import bisect
+import itertools
+import threading
+
+from purrsync import FileSet
+
+# Size of a bucket (in characters), above which it is burst into child nodes
+BUCKET = 4096
+# Characters saved by moving a group of suffixes into a child node, below
+# which the group is left in the bucket
+GROUP = 256
+# Size ratio of the trie to the pending keys, above which they are kept
+# pending instead of being inserted.
+PENDING = 8
+
+
+class FileTrie(FileSet.FileList):
+    SORTED = True
+
+    def __init__(self, setIter=set(), filename=None, updatefn=None, root=None,
+                 from0=False):
+        """ Initialize FileTrie
+        Args: See FileSet.
+
+        A FileTrie stores the same canonical keys as a FileSet, in a burst
+        trie of path components. Each node is a list [children, bucket]:
+        children maps a path component to the child node of the keys below
+        it (or is None), and the bucket is a single string of the other
+        keys of the node (relative to it), sorted and NUL-delimited.
+
+        A bucket is burst when it grows above BUCKET characters: groups of
+        keys sharing a directory are moved into child nodes, where doing
+        so saves at least GROUP characters. Common directories are stored
+        once, and there is no object per path, so a FileTrie uses less
+        memory than a FileSet.
+
+        Members iterate in sorted order without sorting, subtree returns
+        all members at or below a path. Intersections and differences
+        stream the members into the result, merged with other sorted
+        file lists. Keys must not contain NUL.
+        """
+        self.__lock = threading.Lock()
+        FileSet.FileList.__init__(self, setIter=setIter, filename=filename,
+                                  updatefn=updatefn, root=root, from0=from0)
+
+    def updateKeys(self, keys):
+        """
+        Updates the set with canonical keys, without normalization.
+        Keys are added as pending, and inserted once there are enough of
+        them to be worth rebuilding the buckets they fall in.
+        """
+        self.__pending.extend(keys)
+        if len(self.__pending) * PENDING >= self.__len:
+            self.__flush()
+
+    def hasKey(self, key):
+        """
+        Returns True if the canonical key is a member, without
+        normalization.
+        """
+        self.__flush()
+        sep = self.__sep()
+        children, bucket = self.__trie
+        while not isinstance(children, type(None)):
+            component, found, rest = key.partition(sep)
+            child = children.get(component) if found else None
+            if isinstance(child, type(None)):
+                break
+            (children, bucket), key = child, rest
+        return search(bucket, key)
+
+    def discardKeys(self, keys):
+        """
+        Removes canonical keys from the set, without normalization.
+        """
+        self.__flush()
+        keys = list(keys)
+        if keys:
+            self.__len -= self.__delete(self.__trie, keys)
+
+    def subtree(self, pathstring):
+        """
+        Returns a FileTrie of the members at or below pathstring.
+        """
+        newSet = self.empty()
+        try:
+            key = self.keyOf(pathstring)
+        except ValueError:
+            return newSet
+        if not key:
+            return self.copy()
+        self.__flush()
+        sep = self.__sep()
+        node, prefix, rest = self.__trie, key[:0], key
+        while not isinstance(node[0], type(None)):
+            component, found, tail = rest.partition(sep)
+            if not found or component not in node[0]:
+                break
+            node = node[0][component]
+            prefix, rest = prefix + component + sep, tail
+        if not rest:
+            newSet.updateKeys(self.__iterate(node, prefix))
+            return newSet
+        below = rest + sep
+        keys = [prefix + item for item in unpack(node[1])
+                if item == rest or item.startswith(below)]
+        if not isinstance(node[0], type(None)) and rest in node[0]:
+            keys.extend(self.__iterate(node[0][rest], prefix + below))
+        newSet.updateKeys(keys)
+        return newSet
+
+    def __merges(self, other):
+        """
+        Returns True if other is a sorted file list of the same root,
+        i.e. its keys can be merged with the keys of the set.
+        """
+        return (getattr(other, 'SORTED', False) and
+                self.normroot == other.normroot)
+
+    def __member(self, other):
+        """
+        Returns a test of keys for membership of other. File lists of
+        the same root are tested in place, other keys are collected.
+        """
+        if hasattr(other, 'hasKey') and self.normroot == other.normroot:
+            return other.hasKey
+        return set(self.keysOf(other)).__contains__
+
+    def __extend(self, keys):
+        """
+        Updates the set with canonical keys, BUCKET keys at a time, so
+        that keys streamed from another file list are not all held.
+        """
+        keys = iter(keys)
+        while True:
+            chunk = list(itertools.islice(keys, BUCKET))
+            if not chunk:
+                break
+            self.updateKeys(chunk)
+
+    def __sep(self):
+        return os.fsencode(os.sep) if self.from0 else os.sep
+
+    def __node(self):
+        """ Returns an empty node. """
+        return [None, b'\0' if self.from0 else '\0']
+
+    def __flush(self):
+        """ Inserts the pending keys. """
+        if not self.__pending:
+            return
+        with self.__lock:
+            if self.__pending:
+                self.__len += self.__insert(self.__trie, self.__pending)
+                self.__pending = list()
+
+    def __route(self, node, keys):
+        """
+        Splits keys (relative to node) into the keys of the bucket, and
+        a dict of child component: keys relative to the child.
+        """
+        children, sep = node[0], self.__sep()
+        if isinstance(children, type(None)):
+            return keys, dict()
+        local, routed = list(), dict()
+        for key in keys:
+            component, found, rest = key.partition(sep)
+            if found and component in children:
+                routed.setdefault(component, list()).append(rest)
+            else:
+                local.append(key)
+        return local, routed
+
+    def __insert(self, node, keys):
+        """ Inserts keys (relative to node), returns members added. """
+        local, routed = self.__route(node, keys)
+        count = 0
+        for component, childKeys in routed.items():
+            count += self.__insert(node[0][component], childKeys)
+        if local:
+            items = unpack(node[1])
+            size = len(items)
+            items.extend(local)
+            items.sort()
+            items = [item for i, item in enumerate(items)
+                     if not i or not item == items[i - 1]]
+            count += len(items) - size
+            self.__fill(node, items)
+        return count
+
+    def __delete(self, node, keys):
+        """ Removes keys (relative to node), returns members removed. """
+        local, routed = self.__route(node, keys)
+        count = 0
+        for component, childKeys in routed.items():
+            child = node[0][component]
+            count += self.__delete(child, childKeys)
+            if isinstance(child[0], type(None)) and len(child[1]) == 1:
+                del node[0][component]
+        if local:
+            items, local = unpack(node[1]), set(local)
+            kept = [item for item in items if item not in local]
+            count += len(items) - len(kept)
+            node[1] = pack(kept, node[1][:1])
+        if not node[0]:
+            node[0] = None
+        return count
+
+    def __fill(self, node, items):
+        """
+        Stores sorted items (relative to node) in its bucket. Above BUCKET
+        characters, the groups of items sharing a first component are
+        moved into child nodes, if it saves at least GROUP characters each.
+        """
+        delim = node[1][:1]
+        if sum(map(len, items)) + len(items) < BUCKET:
+            node[1] = pack(items, delim)
+            return
+        sep, counts = self.__sep(), dict()
+        for item in items:
+            component, found, rest = item.partition(sep)
+            if found:
+                counts[component] = counts.get(component, 0) + 1
+        moved = set(component for component, count in counts.items()
+                    if count * (len(component) + 1) >= GROUP)
+        children, kept, i = dict(node[0] or dict()), list(), 0
+        # The items of a group are contiguous, as items are sorted.
+        while i < len(items):
+            component, found, rest = items[i].partition(sep)
+            if not (found and component in moved):
+                kept.append(items[i])
+                i += 1
+                continue
+            prefix, rests = component + sep, list()
+            while i < len(items) and items[i].startswith(prefix):
+                rests.append(items[i][len(prefix):])
+                i += 1
+            child = [None, delim]
+            self.__fill(child, rests)
+            children[component] = child
+        if children:
+            # Children are kept in the order of their keys, for iteration.
+            node[0] = dict(sorted(children.items(),
+                                  key=lambda child: child[0] + sep))
+        node[1] = pack(kept, delim)
+
+    def __iterate(self, node, prefix):
+        """
+        Generates the keys of node, prefixed with prefix, in sorted order.
+        Children are merged with the keys of the bucket.
+        """
+        children, items = node[0], unpack(node[1])
+        if isinstance(children, type(None)):
+            yield from (prefix + item for item in items)
+            return
+        sep = self.__sep()
+        i = 0
+        for component, child in children.items():
+            j = bisect.bisect_left(items, component + sep, i)
+            yield from (prefix + item for item in items[i:j])
+            yield from self.__iterate(child, prefix + component + sep)
+            i = j
+        yield from (prefix + item for item in items[i:])
+
+    def __copy(self, node):
+        """ Returns a copy of node. """
+        if isinstance(node[0], type(None)):
+            return [None, node[1]]
+        return [{component: self.__copy(child)
+                 for component, child in node[0].items()}, node[1]]
+
+    # Set methods
+    def clear(self):
+        self.__trie = self.__node()
+        self.__len = 0
+        self.__pending = list()
+
+    def __iter__(self):
+        self.__flush()
+        return self.__iterate(self.__trie, self.__sep()[:0])
+
+    def __len__(self):
+        self.__flush()
+        return self.__len
+
+    def intersection(self, *others):
+        keys = iter(self)
+        for s in others:
+            if self.__merges(s):
+                keys = common(keys, iter(s))
+            else:
+                keys = filter(self.__member(s), keys)
+        newSet = self.empty()
+        newSet.__extend(keys)
+        return newSet
+
+    def difference(self, *others):
+        keys = iter(self)
+        for s in others:
+            if self.__merges(s):
+                keys = only(keys, iter(s))
+            else:
+                keys = itertools.filterfalse(self.__member(s), keys)
+        newSet = self.empty()
+        newSet.__extend(keys)
+        for s in others:
+            if isinstance(s, FileSet.IgnoreSet):
+                s.prune(newSet)
+        return newSet
+
+    def copy(self):
+        """ Returns a copy of FileTrie. """
+        self.__flush()
+        newSet = self.empty()
+        newSet.__trie, newSet.__len = self.__copy(self.__trie), self.__len
+        return newSet
+
+
+def pack(items, delim):
+    """ Returns sorted items as a bucket, delimited by delim. """
+    if not items:
+        return delim
+    return delim + delim.join(items) + delim
+
+
+def unpack(bucket):
+    """ Returns the sorted items of a bucket. """
+    if len(bucket) < 2:
+        return list()
+    return bucket[1:-1].split(bucket[:1])
+
+
+def common(a, b):
+    """ Generates the keys of sorted iterators a and b found in both. """
+    a = iter(a)
+    key = next(a, None)
+    for other in b:
+        while not isinstance(key, type(None)) and key < other:
+            key = next(a, None)
+        if isinstance(key, type(None)):
+            return
+        if key == other:
+            yield key
+            key = next(a, None)
+
+
+def only(a, b):
+    """ Generates the keys of sorted iterator a not found in b. """
+    a = iter(a)
+    key = next(a, None)
+    for other in b:
+        while not isinstance(key, type(None)) and key < other:
+            yield key
+            key = next(a, None)
+        if isinstance(key, type(None)):
+            return
+        if key == other:
+            key = next(a, None)
+    if not isinstance(key, type(None)):
+        yield key
+        yield from a
+
+
+def search(bucket, item):
+    """
+    Returns True if item is in bucket. Large buckets are binary
+    searched, item by item.
+    """
+    delim = bucket[:1]
+    if len(bucket) <= BUCKET:
+        return delim + item + delim in bucket
+    lo, hi = 0, len(bucket) - 1
+    while lo < hi:
+        start = bucket.rfind(delim, lo, (lo + hi) // 2 + 1)
+        end = bucket.find(delim, start + 1)
+        current = bucket[start + 1:end]
+        if current == item:
+            return True
+        if current < item:
+            lo = end
+        else:
+            hi = start
+    return False
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import concurrent.futures as cf
+
+
+class Manifest(dict):
+    # Manifest filename, stored in DEST
+    FILENAME = ".purrsync-manifest"
+
+    def __init__(self, filename=None, source="/", from0=False, jobs=1):
+        """
+        Initialize Manifest
+        Args:
+            filename (str) : Filename to read/write to.
+            source (str)   : Source directory of the synced paths, which
+        must be local.
+            from0 (bool)   : Paths are bytes.
+            jobs (int)     : Number of concurrent stat calls.
+
+        A Manifest maps each bucket (a destination directory, e.g. "main"
+        or "pkg/name") to the (size, mtime, inode) of every path
+        transferred into it by the last successful run.
+        """
+        self.clear()
+        self.filename = filename
+        self.source = source
+        self.from0 = from0
+        self.jobs = jobs
+        self.stats = dict()
+
+    def read(self):
+        """
+        Reads the manifest from filename, if it exists.
+        Records are NUL-terminated fields: bucket, size, mtime, inode, path.
+        """
+        if (isinstance(self.filename, type(None)) or
+                not os.path.isfile(self.filename)):
+            return self
+        with open(self.filename, 'rb') as f:
+            fields = f.read().split(b'\0')
+        for i in range(0, len(fields) - 4, 5):
+            bucket, size, mtime, ino, path = fields[i:i + 5]
+            if not self.from0:
+                path = os.fsdecode(path)
+            self.setdefault(os.fsdecode(bucket), dict())[path] = (
+                int(size), int(mtime), int(ino))
+        return self
+
+    def write(self):
+        """ Writes the manifest to filename. """
+        tmp = self.filename + ".tmp"
+        with open(tmp, 'wb') as f:
+            for bucket, records in self.items():
+                bucket = os.fsencode(bucket)
+                for path, (size, mtime, ino) in records.items():
+                    f.write(b'\0'.join([
+                        bucket,
+                        str(size).encode(),
+                        str(mtime).encode(),
+                        str(ino).encode(),
+                        os.fsencode(path),
+                        bytes()]))
+        os.replace(tmp, self.filename)
+
+    def stat(self, paths):
+        """
+        Stats paths (relative to source) which have not been stat'ed yet.
+        Missing paths are recorded as None.
+        """
+        if isRemote(self.source):
+            raise ValueError("Incremental runs require a local SRC!")
+        source = self.source
+        if self.from0:
+            source = os.fsencode(source)
+
+        def lstat(path):
+            try:
+                st = os.lstat(os.path.join(source, path))
+            except OSError:
+                return (path, None)
+            return (path, (st.st_size, st.st_mtime_ns, st.st_ino))
+
+        paths = [path for path in paths if path not in self.stats]
+        if self.jobs <= 1:
+            self.stats.update(map(lstat, paths))
+            return self.stats
+
+        def lstats(chunk):
+            return [lstat(path) for path in chunk]
+
+        chunks = [paths[i:i + 1024] for i in range(0, len(paths), 1024)]
+        with cf.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(lstats, chunks):
+                self.stats.update(result)
+        return self.stats
+
+    def changed(self, bucket, paths):
+        """
+        Returns the paths which are new to bucket, or have changed since
+        the last run.
+        """
+        stats = self.stat(paths)
+        records = self.get(bucket, dict())
+        return [path for path in paths
+                if isinstance(stats[path], type(None)) or
+                not records.get(path) == stats[path]]
+
+    def moved(self, bucket, paths, syncSet):
+        """
+        Returns the paths of bucket from the last run, which are no
+        longer in bucket (paths) but are still synced (in syncSet),
+        i.e. paths which have moved to another bucket.
+        """
+        removed = set(self.get(bucket, dict())).difference(paths)
+        return [path for path in removed if path in syncSet]
+
+    def retain(self, buckets):
+        """
+        Drops the records of buckets not in buckets, e.g. of removed
+        packages, or of buckets not synced by this run. Their next run
+        transfers all of their paths. Returns a dict of the buckets
+        dropped, and their paths, which are left in DEST.
+        """
+        return {bucket: list(self.pop(bucket))
+                for bucket in set(self).difference(buckets)}
+
+    def update(self, bucket, paths):
+        """ Records paths as transferred into bucket. """
+        stats = self.stat(paths)
+        self[bucket] = {path: stats[path] for path in paths
+                        if not isinstance(stats[path], type(None))}
+
+
+def isRemote(path):
+    """ Returns True if path is a remote rsync path, i.e. host:path. """
+    root = path.split(os.sep)[0]
+    if root:
+        return root[-1] == ":"
+    else:
+        return False
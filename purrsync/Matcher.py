@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import re
+import fnmatch
+
+
+class Matcher:
+    # Trie node marker for a directory rule
+    END = None
+
+    def __init__(self, dirs=list(), globs=list(), regexes=list(),
+                 from0=False):
+        """
+        Initialize Matcher
+        Args:
+            dirs (list)    : Directory keys, matching everything below them.
+            globs (list)   : Glob patterns, see globMatcher.
+            regexes (list) : Regular expressions, searched in the key.
+            from0 (bool)   : Keys are bytes.
+
+        Keys are paths relative to a common root (see FileSet).
+        Directories are kept in a trie of path components, globs and
+        regular expressions are each compiled into a single regex.
+        """
+        self.from0 = from0
+        self.sep = os.fsencode(os.sep) if from0 else os.sep
+        self.trie = dict()
+        self.globs = list()
+        self.regexes = list()
+        self.__globMatch = None
+        self.__regexSearch = None
+        self.__compiled = True
+
+        for key in dirs:
+            self.addDir(key)
+        for glob in globs:
+            self.addGlob(glob)
+        for regex in regexes:
+            self.addRegex(regex)
+
+    def addDir(self, key):
+        node = self.trie
+        for component in self.__components(key):
+            node = node.setdefault(component, dict())
+        node[self.END] = True
+
+    def addGlob(self, glob):
+        self.globs.append(glob)
+        self.__compiled = False
+
+    def addRegex(self, regex):
+        self.regexes.append(os.fsdecode(regex))
+        self.__compiled = False
+
+    def prunes(self, key):
+        """ Returns True if key is (under) a directory rule. """
+        node = self.trie
+        if self.END in node:
+            return True
+        for component in self.__components(key):
+            node = node.get(component)
+            if isinstance(node, type(None)):
+                return False
+            if self.END in node:
+                return True
+        return False
+
+    def match(self, key):
+        """ Returns True if key matches any rule. """
+        if self.trie and self.prunes(key):
+            return True
+        if not self.__compiled:
+            self.__compile()
+        if self.__globMatch:
+            name = key.rpartition(self.sep)[2]
+            if self.__globMatch(key, name):
+                return True
+        if self.__regexSearch:
+            return bool(self.__regexSearch(key))
+        return False
+
+    def __bool__(self):
+        return bool(self.trie or self.globs or self.regexes)
+
+    def __compile(self):
+        """ Compiles globs and regular expressions into one regex each. """
+        self.__globMatch = None
+        self.__regexSearch = None
+        if self.globs:
+            self.__globMatch = globMatcher(self.globs, self.from0)
+        if self.regexes:
+            self.__regexSearch = compileRegex(
+                '|'.join('(?:' + r + ')' for r in self.regexes),
+                self.from0).search
+        self.__compiled = True
+
+    def __components(self, key):
+        return [c for c in key.split(self.sep) if c]
+
+
+def globMatcher(patterns, from0=False):
+    """
+    Compiles glob patterns into a function match(key, name).
+    Patterns containing a "/" match key, others match name.
+    """
+    patterns = [os.fsdecode(p) for p in patterns]
+    pathGlobs = [p for p in patterns if os.sep in p]
+    nameGlobs = [p for p in patterns if os.sep not in p]
+
+    def compile(globs):
+        if not globs:
+            return None
+        return compileRegex('|'.join(fnmatch.translate(glob)
+                                     for glob in globs),
+                            from0).match
+
+    pathMatch = compile(pathGlobs)
+    nameMatch = compile(nameGlobs)
+
+    def match(key, name):
+        return bool((nameMatch and nameMatch(name)) or
+                    (pathMatch and pathMatch(key)))
+    return match
+
+
+def compileRegex(regex, from0=False):
+    """ Compiles regex, for bytes if from0 is set. """
+    if from0:
+        regex = os.fsencode(regex)
+    return re.compile(regex)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import re
+import collections
+import concurrent.futures as cf
+
+# Package databases
+GENTOO = "gentoo"
+DPKG = "dpkg"
+
+DBDIR = {GENTOO: "/var/db/pkg",
+         DPKG: "/var/lib/dpkg/info"}
+
+# Package files read ahead per job, while their paths are consumed
+WINDOW = 4
+# Gentoo package version suffix of ${PF}
+GENTOO_VERSION = re.compile(r'-\d[^-]*(-r\d+)?$')
+
+
+def readPackages(db, dbdir=None, root=None, jobs=1, from0=False):
+    """
+    Generates (package, path) pairs from a package database,
+    without running the package manager.
+    Args:
+        db (str)     : The package database, GENTOO or DPKG.
+        dbdir (str)  : The database directory, DBDIR[db] by default.
+        root (str)   : Only paths under root are generated.
+        jobs (int)   : Number of package files to read concurrently.
+        from0 (bool) : Paths are generated as bytes.
+    Packages are generated in order. At most jobs * WINDOW package files
+    are read ahead of the pairs consumed, so memory is bounded by the
+    window rather than by the database.
+    """
+    if isinstance(dbdir, type(None)):
+        dbdir = DBDIR[db]
+    packages, contentsfn = {
+        GENTOO: (gentooPackages, gentooContents),
+        DPKG: (dpkgPackages, dpkgList)}[db]
+
+    prefix = None
+    if not isinstance(root, type(None)):
+        prefix = os.path.normpath(root)
+        if from0:
+            prefix = os.fsencode(prefix)
+
+    def read(package):
+        pkg, filename = package
+        return [path for path in contentsfn(filename, from0)
+                if underRoot(path, prefix)]
+
+    packageList = iter(sorted(packages(dbdir)))
+    jobs = max(jobs, 1)
+    pending = collections.deque()
+    with cf.ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for package in packageList:
+                pending.append((package[0], executor.submit(read, package)))
+                if len(pending) >= jobs * WINDOW:
+                    break
+            if not pending:
+                break
+            pkg, future = pending.popleft()
+            for path in future.result():
+                yield (pkg, path)
+
+
+def gentooPackages(dbdir):
+    """
+    Generates (package, filename) for each package in a Gentoo
+    database, e.g. ("app-shells/bash", ".../app-shells/bash-5.1/CONTENTS").
+    """
+    for category in os.listdir(dbdir):
+        catdir = os.path.join(dbdir, category)
+        if not os.path.isdir(catdir):
+            continue
+        for pf in os.listdir(catdir):
+            filename = os.path.join(catdir, pf, "CONTENTS")
+            if os.path.isfile(filename):
+                pn = GENTOO_VERSION.sub('', pf)
+                yield ("{}/{}".format(category, pn), filename)
+
+
+def gentooContents(filename, from0=False):
+    """
+    Generates paths from a Gentoo CONTENTS file, i.e. lines of
+    "dir PATH", "obj PATH MD5 MTIME" or "sym PATH -> TARGET MTIME".
+    """
+    with open(filename, 'rb') as f:
+        for line in f:
+            kind, _, entry = line.rstrip(b'\n').partition(b' ')
+            if kind == b'obj':
+                entry = entry.rsplit(b' ', 2)[0]
+            elif kind == b'sym':
+                entry = entry.split(b' -> ', 1)[0]
+            if entry:
+                yield entry if from0 else os.fsdecode(entry)
+
+
+def dpkgPackages(dbdir):
+    """
+    Generates (package, filename) for each package in a dpkg
+    database, e.g. ("bash", ".../info/bash.list").
+    """
+    for name in os.listdir(dbdir):
+        if name.endswith(".list"):
+            yield (name[:-len(".list")], os.path.join(dbdir, name))
+
+
+def dpkgList(filename, from0=False):
+    """ Generates paths from a dpkg .list file. """
+    with open(filename, 'rb') as f:
+        for line in f:
+            entry = line.rstrip(b'\n')
+            # The root directory is listed as "/."
+            if entry and not entry == b'/.':
+                yield entry if from0 else os.fsdecode(entry)
+
+
+def underRoot(path, root):
+    """ Returns True if path is root or under root (or root is None). """
+    if isinstance(root, type(None)):
+        return True
+    sep = os.sep if isinstance(root, str) else os.fsencode(os.sep)
+    if path == root:
+        return True
+    if not root.endswith(sep):
+        root += sep
+    return path.startswith(root)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import abc
+
+from purrsync import FileSet
+from purrsync import FileBitmap
+
+
+class Plan(abc.ABC):
+    def __init__(self, normroot=None):
+        """
+        Initialize Plan
+        Args:
+            normroot (str): The normalized root of the keys of the plan.
+
+        A Plan is a lazy set expression over file lists, e.g.
+        (main - ignore) & pkg. Nothing is copied: members are generated
+        from the operands each time the plan is iterated, and membership
+        is tested against the operands directly.
+        """
+        self.normroot = normroot
+
+    @abc.abstractmethod
+    def __iter__(self):
+        """ Generates the members, as keys relative to normroot. """
+
+    @abc.abstractmethod
+    def __contains__(self, key):
+        """ Returns True if key, relative to normroot, is a member. """
+
+    @abc.abstractmethod
+    def size(self):
+        """ Returns an upper bound of the number of members. """
+
+    def keys(self, normroot):
+        """ Generates the members as keys relative to normroot. """
+        if normroot == self.normroot:
+            yield from self
+            return
+        for key in self:
+            try:
+                yield rekey(key, self.normroot, normroot)
+            except ValueError:
+                continue
+
+    def has(self, key, normroot):
+        """ Returns True if key, relative to normroot, is a member. """
+        if normroot == self.normroot:
+            return key in self
+        try:
+            return rekey(key, normroot, self.normroot) in self
+        except ValueError:
+            return False
+
+    def normpath(self):
+        """ Returns the set with normalized paths."""
+        return set({FileSet.rootPath(key, self.normroot)
+                    for key in self})
+
+    def __set__(self):
+        """ Returns a plain set of the members. """
+        return set(self)
+
+    def bitmap(self):
+        """
+        Returns the members as (PathTable, bits) if the plan is over
+        FileBitmaps, otherwise None.
+        """
+        return None
+
+    def __and__(self, other):
+        return And(self, leaf(other))
+
+    def __sub__(self, other):
+        return Diff(self, leaf(other))
+
+    def __or__(self, other):
+        return Union(self, leaf(other))
+
+
+class Leaf(Plan):
+    def __init__(self, keys, normroot=None):
+        """
+        Initialize Leaf
+        Args:
+            keys (iter)   : A file list, or any container of keys.
+            normroot (str): The normalized root of keys, by default
+        the root of the file list.
+
+        Paths ignored by the rules of an IgnoreSet are members, but are
+        not generated when iterating.
+        """
+        Plan.__init__(self, getattr(keys, 'normroot', normroot))
+        self.fileset = keys
+        self.__contains = keys.__contains__
+        if isinstance(keys, FileSet.IgnoreSet):
+            self.__contains = self.__ignores
+        elif hasattr(keys, 'hasKey'):
+            # Keys are canonical, skip normalization.
+            self.__contains = keys.hasKey
+
+    def __ignores(self, key):
+        return self.fileset.hasKey(key) or self.fileset.matcher().match(key)
+
+    def __iter__(self):
+        return iter(self.fileset)
+
+    def __contains__(self, key):
+        return self.__contains(key)
+
+    def size(self):
+        return len(self.fileset)
+
+    def bitmap(self):
+        if isinstance(self.fileset, FileBitmap.FileBitmap):
+            return (self.fileset.table, self.fileset.bits)
+        return None
+
+
+class Node(Plan):
+    def __init__(self, a, b):
+        """
+        A set operation of plans a and b.
+        If a is over FileBitmaps, the members are evaluated as a bitmap
+        once, when first iterated: with a single bitwise operation if b
+        is over the same PathTable and root, otherwise by iterating the
+        plan.
+        The operands must not change after that.
+        """
+        Plan.__init__(self, a.normroot)
+        self.a, self.b = a, b
+        self.__bitmap = None
+
+    def __iter__(self):
+        bitmap = self.bitmap()
+        if isinstance(bitmap, type(None)):
+            return self.members()
+        table, bits = bitmap
+        keys = table.keys
+        return (keys[i] for i in FileBitmap.members(bits))
+
+    @abc.abstractmethod
+    def members(self):
+        """ Generates the members from the operands. """
+
+    @abc.abstractmethod
+    def combine(self, a, b):
+        """ Returns the bits of the operation on bits a and b. """
+
+    def bitmap(self):
+        if not isinstance(self.__bitmap, type(None)):
+            return self.__bitmap
+        a = self.a.bitmap()
+        if isinstance(a, type(None)):
+            return None
+        table = a[0]
+        b = self.b.bitmap()
+        if (not isinstance(b, type(None)) and b[0] is table and
+                self.b.normroot == self.normroot):
+            bits = self.combine(a[1], b[1])
+        else:
+            bits = FileBitmap.bitmap(map(table.ids.__getitem__,
+                                         self.members()))
+        self.__bitmap = (table, bits)
+        return self.__bitmap
+
+
+class Diff(Node):
+    def __init__(self, a, b):
+        """ Members of plan a, which are not in plan b. """
+        Node.__init__(self, a, b)
+
+    def members(self):
+        b, normroot = self.b, self.normroot
+        return (key for key in self.a if not b.has(key, normroot))
+
+    def combine(self, a, b):
+        return a & ~b
+
+    def __contains__(self, key):
+        return key in self.a and not self.b.has(key, self.normroot)
+
+    def size(self):
+        return self.a.size()
+
+
+class And(Node):
+    def __init__(self, a, b):
+        """
+        Members of both plans a and b.
+        The smaller plan is iterated, and looked up in the other.
+        """
+        Node.__init__(self, a, b)
+
+    def combine(self, a, b):
+        return a & b
+
+    def members(self):
+        normroot = self.normroot
+        if self.b.size() < self.a.size():
+            a = self.a
+            return (key for key in self.b.keys(normroot) if key in a)
+        b = self.b
+        return (key for key in self.a if b.has(key, normroot))
+
+    def __contains__(self, key):
+        return key in self.a and self.b.has(key, self.normroot)
+
+    def size(self):
+        return min(self.a.size(), self.b.size())
+
+
+class Union(Node):
+    def __init__(self, a, b):
+        """ Members of plan a or b. """
+        Node.__init__(self, a, b)
+
+    def combine(self, a, b):
+        return a | b
+
+    def bitmap(self):
+        # Members of b may be missing from the table of a.
+        a, b = self.a.bitmap(), self.b.bitmap()
+        if (isinstance(a, type(None)) or isinstance(b, type(None)) or
+                a[0] is not b[0] or not self.b.normroot == self.normroot):
+            return None
+        return (a[0], a[1] | b[1])
+
+    def members(self):
+        yield from self.a
+        a = self.a
+        for key in self.b.keys(self.normroot):
+            if key not in a:
+                yield key
+
+    def __contains__(self, key):
+        return key in self.a or self.b.has(key, self.normroot)
+
+    def size(self):
+        return self.a.size() + self.b.size()
+
+
+def leaf(keys):
+    """ Returns keys as a Plan, file lists are wrapped in a Leaf. """
+    if isinstance(keys, Plan):
+        return keys
+    return Leaf(keys)
+
+
+def rekey(key, normroot, newroot):
+    """ Returns key relative to normroot as a key relative to newroot. """
+    return FileSet.canonicalPath(FileSet.rootPath(key, normroot), newroot)
@@ -4,9 +4,16 @@
 
 import subprocess as sp
 import os
-import tempfile
+import time
+import fcntl
+import shutil
+import threading
+import concurrent.futures as cf
 
 from purrsync import FileSet
+from purrsync import Plan
+from purrsync import Stats
+from purrsync import Transfer
 
 
 class Rsync:
@@ -17,6 +24,10 @@ class Rsync:
     ROOT = "root"
     BACKUP = "backup"
 
+    # Link modes
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+
     def __init__(self,
                  source="/",
                  destination="./",
@@ -25,9 +36,35 @@ class Rsync:
                  packageSet=dict(),
                  rsyncBin="",
                  rsyncArgs="",
-                 backup_dir=None):
+                 backup_dir=None,
+                 jobs=1,
+                 link=None,
+                 from0=False,
+                 manifest=None,
+                 stats=None,
+                 transferStats=False):
         """
         This class provides an interface to rsync w/ filesets.
+        Up to `jobs` rsync processes are run concurrently.
+
+        If link is HARDLINK or REFLINK, only the main set is
+        transferred with rsync. Package and orphan trees are linked
+        from the main tree in the (local) destination.
+
+        If from0 is set, paths are bytes and file lists are passed
+        to rsync NUL-delimited (--from0).
+
+        If a Manifest is given, only paths which are new or changed since
+        the last run are transferred. Paths which moved to another bucket
+        are removed from their old (local) destination.
+
+        Every transfer is recorded as a phase "rsync/NAME" in stats
+        (a Stats), with the number of paths passed to rsync.
+
+        If transferStats is set, rsync is run with --stats and
+        --itemize-changes, and its output is parsed into a Transfer
+        record per transfer, in self.transfers. Otherwise only the exit
+        status and duration are recorded.
         """
         self.source = source
         self.destination = destination
@@ -37,8 +74,21 @@ class Rsync:
         self.rsyncArgs = rsyncArgs
         self.rsyncBin = rsyncBin
         self.backup_dir = backup_dir
+        self.jobs = jobs
+        self.link = link
+        self.from0 = from0
+        self.manifest = manifest
+        self.stats = stats
+        self.transferStats = transferStats
+        self.returncodes = dict()
+        self.transfers = dict()
+
+        self.__syncSet = None
+        self.__orphanSet = None
 
         # Override
+        if isinstance(stats, type(None)):
+            self.stats = Stats.Stats()
         if not rsyncBin:
             self.rsyncBin = self.which()
 
@@ -54,8 +104,31 @@ class Rsync:
               src,
               dest
               ):
-        """ Uses rsync to synchronize files based on filelists. """
-        filesfrom = "--files-from=" + filelist
+        """
+        Uses rsync to synchronize files based on filelists.
+        If filelist is "-", the file list is read from proc.stdin.
+        """
+        stdin = None
+        if filelist == "-":
+            stdin = sp.PIPE
+        stdout = None
+        if self.transferStats:
+            stdout = sp.PIPE
+
+        proc = sp.Popen(self.command(filelist, src, dest),
+                        stdin=stdin,
+                        stdout=stdout)
+        self.stats.spawned()
+        return proc
+
+    def command(self, filelist, src, dest):
+        """ Returns the rsync command line of a transfer, see rsync. """
+        filesfrom = ["--files-from=" + filelist]
+        if self.from0:
+            filesfrom.append("--from0")
+        statsArgs = []
+        if self.transferStats:
+            statsArgs = ["--stats", "--itemize-changes"]
 
         backupArgs = []
         if not isinstance(self.backup_dir,
@@ -66,73 +139,292 @@ class Rsync:
             backupArgs.append("--backup")
             backupArgs.append("--backup-dir={}".format(backupDir))
 
-        return sp.Popen([self.rsyncBin] +
-                        self.rsyncArgs.split() +
-                        backupArgs +
-                        [filesfrom,
-                         src,
-                         dest])
+        return ([self.rsyncBin] +
+                self.rsyncArgs.split() +
+                backupArgs +
+                statsArgs +
+                filesfrom +
+                [src,
+                 dest])
+
+    def syncSet(self):
+        """
+        Returns the main set without ignored files, as a lazy Plan.
+        The plan is shared by all rsync methods, and evaluated by each
+        transfer as rsync consumes its file list.
+        """
+        if isinstance(self.__syncSet, type(None)):
+            self.__syncSet = Plan.leaf(self.mainSet) - self.ignoreSet
+        return self.__syncSet
+
+    def orphanSet(self):
+        """
+        Returns the sync set without packaged files, as a lazy Plan.
+        For a PackageSource, the ownership index is used, so that all
+        packages are excluded in a single pass. The index is rebuilt
+        first, as package sets may have been modified directly.
+        """
+        if isinstance(self.__orphanSet, type(None)):
+            if isinstance(self.packageSet, FileSet.PackageSource):
+                self.packageSet.reindex()
+                self.__orphanSet = self.syncSet() - Plan.Leaf(
+                    self.packageSet.pathIndex, self.packageSet.normroot)
+            else:
+                self.__orphanSet = self.syncSet()
+                for pSet in self.packageSet.values():
+                    self.__orphanSet = self.__orphanSet - pSet
+        return self.__orphanSet
 
     def rsyncMain(self):
         """ Rsyncs main set. """
-        with tempfile.NamedTemporaryFile(mode='r') as syncCacheFile:
-            syncSet = self.mainSet - self.ignoreSet
-            syncSet.filename = syncCacheFile.name
-            syncSet.write()
-
-            src = self.source
-            dest = os.path.join(self.destination,
-                                self.MAIN,
-                                self.ROOT)
-
-            proc = self.rsync(syncCacheFile.name,
-                              src,
-                              dest)
-            proc.communicate()
-        return proc
+        return self.__transfer(self.MAIN,
+                               self.syncSet,
+                               self.__dest(self.MAIN))
 
     def rsyncPackages(self):
-        """ Rsyncs packages. """
-        mainSet = self.mainSet - self.ignoreSet
-        for pkgName, pSet in self.packageSet.items():
-            with tempfile.NamedTemporaryFile(mode='r') as syncCacheFile:
-                syncSet = mainSet & pSet
-                syncSet.filename = syncCacheFile.name
-                syncSet.write()
-
-                src = self.source
-                dest = os.path.join(self.destination,
-                                    self.PACKAGE,
-                                    pkgName,
-                                    self.ROOT)
-                proc = self.rsync(
-                    syncCacheFile.name,
-                    src,
-                    dest)
-                proc.communicate()
-
-                yield (pkgName, proc)
+        """
+        Rsyncs packages.
+        Yields (pkgName, proc) as each transfer completes.
+        """
+        for name, proc in self.__pool(self.__packageTransfers()):
+            yield (os.path.relpath(name, self.PACKAGE), proc)
 
     def rsyncOrphans(self):
         """ Rsyncs orphaned files. """
-        mainSet = self.mainSet - self.ignoreSet
-        orphanSet = self.mainSet - self.ignoreSet
-        for pSet in self.packageSet.values():
-            orphanSet = orphanSet - (mainSet & pSet)
-
-        with tempfile.NamedTemporaryFile(mode='r') as syncCacheFile:
-            orphanSet.filename = syncCacheFile.name
-            orphanSet.write()
-            src = self.source
-            dest = os.path.join(self.destination,
-                                self.ORPHAN,
-                                self.ROOT)
-            proc = self.rsync(syncCacheFile.name,
-                              src,
-                              dest)
-            proc.communicate()
+        return self.__transfer(self.ORPHAN,
+                               self.orphanSet,
+                               self.__dest(self.ORPHAN))
+
+    def rsyncAll(self, main=True, package=True, orphan=True):
+        """
+        Rsyncs main, package and orphan sets in a single pool.
+        Yields (name, proc) as each transfer completes, where name
+        is the destination directory relative to DEST.
+        """
+        if main and self.link:
+            # Linked trees require the main tree first.
+            yield (self.MAIN, self.rsyncMain())
+            main = False
+        yield from self.__pool(self.transferList(main, package, orphan))
+
+    def transferList(self, main=True, package=True, orphan=True):
+        """ Returns the (name, setfn, dest) transfers of rsyncAll. """
+        transfers = list()
+        if main:
+            transfers.append(
+                (self.MAIN, self.syncSet, self.__dest(self.MAIN)))
+        if package:
+            transfers.extend(self.__packageTransfers())
+        if orphan:
+            transfers.append(
+                (self.ORPHAN, self.orphanSet, self.__dest(self.ORPHAN)))
+        return transfers
+
+    def __packageTransfers(self):
+        """ Returns a (name, setfn, dest) transfer for every package. """
+        mainSet = self.syncSet()
+
+        def setfn(pSet):
+            return lambda: mainSet & pSet
+
+        return [(os.path.join(self.PACKAGE, pkgName),
+                 setfn(pSet),
+                 self.__dest(self.PACKAGE, pkgName))
+                for pkgName, pSet in self.packageSet.items()]
+
+    def __pool(self, transfers):
+        """
+        Runs (name, setfn, dest) transfers with up to self.jobs workers.
+        Yields (name, proc) as each transfer completes.
+        """
+        self.prepareTransfers(transfers)
+        if self.jobs <= 1:
+            for transfer in transfers:
+                yield (transfer[0], self.__transfer(*transfer))
+            return
+
+        with cf.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self.__transfer, *transfer):
+                       transfer[0]
+                       for transfer in transfers}
+            for future in cf.as_completed(futures):
+                yield (futures[future], future.result())
+
+    def prepareTransfers(self, transfers):
+        """
+        Builds the plans shared by (name, setfn, dest) transfers, and
+        stats the manifest, before any of them is run.
+        """
+        self.syncSet()
+        if any(name == self.ORPHAN for name, _, _ in transfers):
+            self.orphanSet()
+        if not isinstance(self.manifest, type(None)):
+            with self.stats.phase('manifest/stat'):
+                self.manifest.stat(self.syncSet())
+
+    def __transfer(self, name, setfn, dest):
+        """
+        Rsyncs the set returned by setfn into dest.
+        The exit code is recorded in self.returncodes[name], and a
+        Transfer record in self.transfers[name].
+        """
+        start = time.perf_counter()
+        with self.stats.phase('rsync/' + name) as counts:
+            proc, counts['paths'], output = self.__run(name, setfn, dest)
+        self.transfers[name] = Transfer.Transfer(
+            name,
+            returncode=proc.returncode,
+            duration=time.perf_counter() - start,
+            paths=counts['paths'],
+            output=output)
         return proc
 
+    def __run(self, name, setfn, dest):
+        """
+        Runs a transfer, see __transfer.
+        Returns the process, the number of paths transferred and the
+        output lines of rsync (if transferStats is set).
+        """
+        syncSet, paths = self.transferPaths(name, setfn, dest)
+
+        count = 0
+        output = list()
+        if self.link and not name == self.MAIN:
+            proc, count = self.linkPaths(paths, dest)
+        elif not isinstance(self.manifest, type(None)) and not paths:
+            # Nothing has changed
+            proc = sp.CompletedProcess([self.rsyncBin], 0)
+        else:
+            proc = self.rsync("-",
+                              self.source,
+                              dest)
+            reader = None
+            if self.transferStats:
+                # Output is read while the file list is written.
+                reader = threading.Thread(
+                    target=lambda: output.extend(
+                        map(os.fsdecode, proc.stdout)))
+                reader.start()
+            try:
+                count = FileSet.writeLines(proc.stdin, paths,
+                                           from0=self.from0)
+                proc.stdin.close()
+            except BrokenPipeError:
+                # rsync exited early, its exit status is recorded below.
+                pass
+            if not isinstance(reader, type(None)):
+                reader.join()
+            proc.wait()
+
+        self.transferDone(name, proc.returncode, syncSet)
+        return proc, count, output
+
+    def transferPaths(self, name, setfn, dest):
+        """
+        Returns the set of transfer `name` and the paths to pass to
+        rsync: all of the set, or with a manifest, only the paths which
+        changed (after pruning those which moved out of dest).
+        """
+        syncSet = setfn()
+        if isinstance(self.manifest, type(None)):
+            return syncSet, syncSet
+        self.__prune(name, syncSet, dest)
+        return syncSet, self.manifest.changed(name, syncSet)
+
+    def transferDone(self, name, returncode, syncSet):
+        """
+        Records the exit code of transfer `name`, and updates the
+        manifest if it succeeded.
+        """
+        self.returncodes[name] = returncode
+        if not (isinstance(self.manifest, type(None)) or returncode):
+            self.manifest.update(name, syncSet)
+
+    def __prune(self, name, syncSet, dest):
+        """
+        Removes the files which moved out of bucket `name` from dest.
+        """
+        if self.__isSshDest():
+            raise ValueError("Incremental runs require a local DEST!")
+        backupDir = self.__backupDir(dest)
+        if self.from0:
+            dest = os.fsencode(dest)
+        for key in self.manifest.moved(name, syncSet, self.syncSet()):
+            dst = os.path.join(dest, key)
+            if os.path.isdir(dst) and not os.path.islink(dst):
+                continue
+            if os.path.lexists(dst):
+                self.__backup(key, dst, backupDir)
+
+    def linkPaths(self, syncSet, dest):
+        """
+        Links the files of syncSet from the main tree into dest.
+        Returns a CompletedProcess, with a non-zero returncode if any
+        file could not be linked, and the number of paths. Keys which
+        are absolute, or outside root, are not linked.
+        """
+        if self.__isSshDest():
+            raise ValueError("Linking requires a local DEST!")
+
+        linkfn = hardlink
+        if self.link == self.REFLINK:
+            linkfn = reflink
+
+        srcRoot = self.__dest(self.MAIN)
+        backupDir = self.__backupDir(dest)
+        if self.from0:
+            srcRoot, dest = os.fsencode(srcRoot), os.fsencode(dest)
+
+        returncode = 0
+        keys = sorted(syncSet)
+        # Sorted, so that directories precede their contents.
+        for key in keys:
+            if not isRelative(key):
+                returncode = 1
+                continue
+            src = os.path.join(srcRoot, key)
+            dst = os.path.join(dest, key)
+            try:
+                if os.path.isdir(src) and not os.path.islink(src):
+                    os.makedirs(dst, exist_ok=True)
+                    continue
+                if os.path.lexists(dst):
+                    if os.path.samestat(os.lstat(src), os.lstat(dst)):
+                        continue
+                    if not isinstance(backupDir, type(None)):
+                        self.__backup(key, dst, backupDir)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                linkfn(src, dst)
+            except OSError:
+                returncode = 1
+        return (sp.CompletedProcess([self.link, srcRoot, dest], returncode),
+                len(keys))
+
+    def __backupDir(self, dest):
+        """ Returns the backup directory for dest, or None. """
+        if isinstance(self.backup_dir, type(None)):
+            return None
+        backupDir = os.path.join(os.path.dirname(dest),
+                                 self.backup_dir)
+        if self.from0:
+            return os.fsencode(backupDir)
+        return backupDir
+
+    def __backup(self, key, dst, backupDir):
+        """ Moves dst into backupDir, or removes it if backupDir is None. """
+        if isinstance(backupDir, type(None)):
+            os.remove(dst)
+            return
+        backup = os.path.join(backupDir, key)
+        os.makedirs(os.path.dirname(backup), exist_ok=True)
+        os.replace(dst, backup)
+
+    def __dest(self, *names):
+        """ Returns the rsync destination root for names. """
+        return os.path.join(self.destination,
+                            *names,
+                            self.ROOT)
+
     def prepareDest(self, main=True, package=True, orphan=True):
         """ Prepares destination directory for rsync. """
         # NB. This probably won't work on Windows Systems.
@@ -190,3 +482,61 @@ class Rsync:
                          package,
                          orphan):
         raise NotImplementedError
+
+
+def hardlink(src, dst):
+    """ Hard links src to dst, replacing dst. """
+    tmp = tmpPath(dst)
+    # Left behind by an interrupted run
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.link(src, tmp, follow_symlinks=False)
+    os.replace(tmp, dst)
+
+
+def reflink(src, dst):
+    """
+    Reflinks (copy-on-write clones) src to dst, replacing dst.
+    Falls back to a hard link if reflinks are unsupported.
+    """
+    # From linux/fs.h
+    FICLONE = 0x40049409
+
+    if os.path.islink(src):
+        return hardlink(src, dst)
+
+    tmp = tmpPath(dst)
+    try:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        return hardlink(src, dst)
+    shutil.copystat(src, tmp)
+    st = os.stat(src)
+    try:
+        os.chown(tmp, st.st_uid, st.st_gid)
+    except PermissionError:
+        pass
+    os.replace(tmp, dst)
+
+
+def isRelative(key):
+    """
+    Returns True if key is a relative path below its root, i.e. it can
+    be joined onto a destination.
+    """
+    pardir, sep = os.pardir, os.sep
+    if isinstance(key, bytes):
+        pardir, sep = os.fsencode(pardir), os.fsencode(sep)
+    return not (os.path.isabs(key) or key.split(sep)[0] == pardir)
+
+
+def tmpPath(dst):
+    """ Returns a temporary path next to dst. """
+    dirname, basename = os.path.split(os.fsdecode(dst))
+    tmp = os.path.join(dirname, '.{}.purrsync'.format(basename))
+    if isinstance(dst, bytes):
+        return os.fsencode(tmp)
+    return tmp
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import os
+import concurrent.futures as cf
+from purrsync import FileSet
+from purrsync import Matcher
+
+
+def scan(src,
+         mainSet,
+         ignoreSet=None,
+         include=list(),
+         exclude=list(),
+         jobs=1,
+         onerror=None):
+    """
+    Walks src and updates the FileSets directly, like "find SRC".
+    Args:
+        src (str)          : Directory to scan.
+        mainSet (FileSet)  : Updated with the included paths.
+        ignoreSet (FileSet): Updated with the excluded paths.
+        include (list)     : Glob patterns of paths to include (default all).
+        exclude (list)     : Glob patterns of paths to exclude.
+        jobs (int)         : Number of directories to scan concurrently.
+        onerror (method)   : Called with an OSError if a directory
+    cannot be scanned, such directories are skipped. If src itself
+    cannot be scanned, the OSError is raised instead.
+
+    Patterns containing a "/" match the path relative to src, others
+    match the file name. Symbolic links are not followed.
+    Paths are added relative to src, the file lists (root) are
+    expected to refer to the same tree. Directories ignored by the
+    rules of an IgnoreSet are not scanned at all.
+    """
+    sep = os.sep
+    if mainSet.from0:
+        src, sep = os.fsencode(src), os.fsencode(sep)
+    isIncluded = Matcher.globMatcher(include, mainSet.from0)
+    isExcluded = Matcher.globMatcher(exclude, mainSet.from0)
+    isPruned = None
+    if isinstance(ignoreSet, FileSet.IgnoreSet) and ignoreSet.matcher():
+        isPruned = ignoreSet.matcher().prunes
+
+    def scandir(dirkey):
+        """ Returns the (key, name, isdir) entries of dirkey. """
+        entries = list()
+        try:
+            with os.scandir(os.path.join(src, dirkey)) as it:
+                for entry in it:
+                    key = dirkey + sep + entry.name if dirkey else entry.name
+                    entries.append(
+                        (key, entry.name,
+                         entry.is_dir(follow_symlinks=False)))
+        except OSError as err:
+            if not dirkey:
+                raise
+            if not isinstance(onerror, type(None)):
+                onerror(err)
+        return entries
+
+    def update(entries):
+        """ Updates the FileSets, returns the subdirectories to scan. """
+        mainKeys, ignoreKeys, subdirs = list(), list(), list()
+        for key, name, isdir in entries:
+            if isPruned and isPruned(key):
+                continue
+            if exclude and isExcluded(key, name):
+                ignoreKeys.append(key)
+            elif not include or isIncluded(key, name):
+                mainKeys.append(key)
+            if isdir:
+                subdirs.append(key)
+        mainSet.updateKeys(mainKeys)
+        if not isinstance(ignoreSet, type(None)):
+            ignoreSet.updateKeys(ignoreKeys)
+        return subdirs
+
+    root = src[:0]
+    if jobs <= 1:
+        pending = [root]
+        while pending:
+            pending.extend(update(scandir(pending.pop())))
+        return mainSet
+
+    with cf.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {executor.submit(scandir, root)}
+        while pending:
+            done, pending = cf.wait(pending,
+                                    return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                for dirkey in update(future.result()):
+                    pending.add(executor.submit(scandir, dirkey))
+    return mainSet
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import json
+import time
+import resource
+import threading
+import contextlib
+
+
+class Stats(dict):
+    def __init__(self):
+        """
+        Initialize Stats
+        Maps phase names to records of their calls, wall time, CPU time,
+        number of paths, processes spawned and peak RSS. Processes
+        spawned are counted for the whole run as well.
+        Phases may be recorded from several threads.
+        """
+        self.clear()
+        self.spawns = 0
+        self.lock = threading.Lock()
+        self.start = (time.perf_counter(), time.process_time())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Records the wall and CPU time of a block as phase name, with
+        the processes spawned during the block, and the peak RSS (in
+        KiB) of purrsync and of its children when it exits.
+        Yields a dict, in which the block may set 'paths'.
+        CPU time and processes spawned are those of the whole process,
+        so concurrent phases overlap.
+        """
+        counts = {'paths': 0}
+        wall, cpu = time.perf_counter(), time.process_time()
+        spawns = self.spawns
+        try:
+            yield counts
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            with self.lock:
+                record = self.setdefault(name, {'calls': 0,
+                                                'wall': 0.0,
+                                                'cpu': 0.0,
+                                                'paths': 0,
+                                                'spawns': 0,
+                                                'maxrss': 0,
+                                                'maxrss_children': 0})
+                record['calls'] += 1
+                record['wall'] += wall
+                record['cpu'] += cpu
+                record['paths'] += counts['paths']
+                record['spawns'] += self.spawns - spawns
+                record['maxrss'] = max(record['maxrss'], own.ru_maxrss)
+                record['maxrss_children'] = max(record['maxrss_children'],
+                                                children.ru_maxrss)
+
+    def spawned(self, count=1):
+        """ Counts processes spawned. """
+        with self.lock:
+            self.spawns += count
+
+    def report(self):
+        """
+        Returns a dict of all phases, the total wall and CPU time,
+        processes spawned and the peak RSS (in KiB) of purrsync and
+        of its children.
+        """
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            return {'phases': {name: dict(record)
+                               for name, record in self.items()},
+                    'wall': time.perf_counter() - self.start[0],
+                    'cpu': time.process_time() - self.start[1],
+                    'cpu_children': children.ru_utime + children.ru_stime,
+                    'spawns': self.spawns,
+                    'maxrss': own.ru_maxrss,
+                    'maxrss_children': children.ru_maxrss}
+
+    def write(self, filename):
+        """ Writes the report to filename as JSON. """
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=1, sort_keys=True)
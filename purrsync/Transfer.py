@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import re
+import json
+
+# rsync --stats lines, e.g. "Total bytes sent: 1,234"
+STATS = {'Number of regular files transferred': 'files',
+         'Total file size': 'total_size',
+         'Total transferred file size': 'transferred_size',
+         'Total bytes sent': 'bytes_sent',
+         'Total bytes received': 'bytes_received'}
+STATS_LINE = re.compile(r'^([A-Za-z ]+): ([\d,.]+)')
+SPEEDUP = re.compile(r'speedup is ([\d,.]+)')
+# rsync --itemize-changes lines, e.g. ">f+++++++++ etc/fstab"
+ITEMIZED = re.compile(r'^[<>ch.*][fdLDS][^ ]* ')
+
+
+class Transfer(dict):
+    def __init__(self, name, returncode=0, duration=0.0, paths=0,
+                 output=list()):
+        """
+        Initialize Transfer
+        Args:
+            name (str)       : Name of the transfer, e.g. "pkg/cat/name".
+            returncode (int) : Exit status of rsync.
+            duration (float) : Wall time of the transfer in seconds.
+            paths (int)      : Number of paths passed to rsync.
+            output (list)    : Output lines of rsync --stats --itemize-changes.
+
+        A result record of one transfer, parsed from the output of rsync.
+        Values missing from the output are 0.
+        """
+        self.clear()
+        bucket, _, package = name.partition('/')
+        self['name'] = name
+        self['bucket'] = bucket
+        self['package'] = package or None
+        self['exit'] = returncode
+        self['duration'] = duration
+        self['paths'] = paths
+        self['itemized'] = 0
+        self['speedup'] = 0.0
+        for key in STATS.values():
+            self[key] = 0
+        self.parse(output)
+
+    def parse(self, lines):
+        """ Updates the record from rsync output lines. """
+        for line in lines:
+            if ITEMIZED.match(line):
+                self['itemized'] += 1
+                continue
+            match = STATS_LINE.match(line)
+            if match and match.group(1) in STATS:
+                self[STATS[match.group(1)]] = number(match.group(2))
+                continue
+            match = SPEEDUP.search(line)
+            if match:
+                self['speedup'] = float(number(match.group(1)))
+
+
+def summary(transfers, top=10):
+    """
+    Returns a summary of Transfer records: totals per bucket and for
+    the run, the failed transfers and the top slowest transfers.
+    """
+    totals = dict()
+    for transfer in transfers:
+        for bucket in [transfer['bucket'], 'total']:
+            total = totals.setdefault(bucket, {'transfers': 0,
+                                               'files': 0,
+                                               'paths': 0,
+                                               'bytes_sent': 0,
+                                               'bytes_received': 0,
+                                               'duration': 0.0})
+            total['transfers'] += 1
+            for key in ['files', 'paths', 'bytes_sent', 'bytes_received',
+                        'duration']:
+                total[key] += transfer[key]
+
+    slowest = sorted(transfers, key=lambda t: t['duration'], reverse=True)
+    return {'buckets': totals,
+            'failed': sorted(t['name'] for t in transfers if t['exit']),
+            'slowest': [{'name': t['name'],
+                         'duration': t['duration'],
+                         'bytes_sent': t['bytes_sent'],
+                         'files': t['files']}
+                        for t in slowest[:top]]}
+
+
+def write(filename, transfers, top=10):
+    """ Writes the Transfer records and their summary as JSON. """
+    transfers = list(transfers)
+    with open(filename, 'w') as f:
+        json.dump({'transfers': {t['name']: t for t in transfers},
+                   'summary': summary(transfers, top)},
+                  f, indent=1, sort_keys=True)
+
+
+def number(string):
+    """ Returns an int (or float) of a number like "1,234" or "5.00". """
+    string = string.replace(',', '')
+    if '.' in string:
+        return float(string)
+    return int(string)
@@ -4,11 +4,28 @@
 
 import sys
 import os
+import glob
 import argparse
+import cProfile
+import functools
 import subprocess as sp
 
 from purrsync import FileSet
+from purrsync import FileTrie
+from purrsync import FileBitmap
+from purrsync import FileArray
 from purrsync import Rsync
+from purrsync import PackageDB
+from purrsync import Manifest
+from purrsync import Scanner
+from purrsync import Stats
+from purrsync import Transfer
+
+# File list storage, see --storage
+STORAGE = {'set': FileSet.FileSet,
+           'trie': FileTrie.FileTrie,
+           'bitmap': FileBitmap.FileBitmap,
+           'sorted': FileArray.FileArray}
 
 
 def main():
@@ -39,7 +56,8 @@ def main():
         metavar='IGNORE_FILE',
         type=str,
         nargs='?',
-        help='Ignore list of files')
+        help='Ignore list of files.\n' +
+        'Lines "glob:PATTERN", "re:REGEX" and "DIRECTORY/" are rules.')
     parser.add_argument(
         '-p', '--package',
         action='store_true',
@@ -67,6 +85,29 @@ def main():
         type=str,
         nargs='?',
         help='Use IGNORE_EXEC to produce an ignore list.')
+    parser.add_argument(
+        '-s', '--scan',
+        action='store_true',
+        help='Scan SRC (or the --alt-root) for the file list, instead of\n' +
+        'using MAIN_EXEC.')
+    parser.add_argument(
+        '--scan-include',
+        metavar='GLOB',
+        type=str,
+        action='append',
+        default=list(),
+        help='Only add scanned paths matching GLOB to the file list.\n' +
+        'GLOB matches the file name, or the path if it contains a "/".\n' +
+        'May be given multiple times.')
+    parser.add_argument(
+        '--scan-exclude',
+        metavar='GLOB',
+        type=str,
+        action='append',
+        default=list(),
+        help='Add scanned paths matching GLOB to the ignore list.\n' +
+        'GLOB matches the file name, or the path if it contains a "/".\n' +
+        'May be given multiple times.')
     parser.add_argument(
         '-e', '--package-exec',
         metavar='PKG_EXEC',
@@ -80,6 +121,66 @@ def main():
         type=str,
         nargs='?',
         help='Use PKG_LIST_EXEC to produce a list of packages.')
+    parser.add_argument(
+        '-M', '--package-map-exec',
+        metavar='PKG_MAP_EXEC',
+        type=str,
+        nargs='?',
+        help='Use PKG_MAP_EXEC to produce "package path" lines for\n' +
+        'all packages at once.')
+    parser.add_argument(
+        '-P', '--package-map-file',
+        metavar='PKG_MAP_FILE',
+        type=str,
+        nargs='?',
+        help='Read "package path" lines for all packages from PKG_MAP_FILE.')
+    parser.add_argument(
+        '-d', '--package-db',
+        metavar='PKG_DB',
+        type=str,
+        nargs='?',
+        choices=[PackageDB.GENTOO, PackageDB.DPKG],
+        help='Read package file lists directly from the package database,\n' +
+        'either "gentoo" (/var/db/pkg) or "dpkg" (/var/lib/dpkg/info).')
+    parser.add_argument(
+        '--package-db-dir',
+        metavar='PKG_DB_DIR',
+        type=str,
+        nargs='?',
+        help='Use an alternative directory for PKG_DB.')
+    parser.add_argument(
+        '-K', '--package-key-exec',
+        metavar='KEY_EXEC',
+        type=str,
+        nargs='?',
+        help='Cache PKG_EXEC file lists in PKG_DIR. The output of KEY_EXEC\n' +
+        'is the package fingerprint, {} is replaced with the package name.\n' +
+        'PKG_EXEC is only run if the fingerprint changed.')
+    parser.add_argument(
+        '-k', '--package-key-file',
+        metavar='KEY_FILE',
+        type=str,
+        nargs='?',
+        help='Cache PKG_EXEC file lists in PKG_DIR. The size and mtime of\n' +
+        'the files matching the KEY_FILE pattern are the package\n' +
+        'fingerprint, {} is replaced with the package name.\n' +
+        'PKG_EXEC is only run if the fingerprint changed.')
+    parser.add_argument(
+        '-O', '--owner',
+        metavar='PATH',
+        type=str,
+        action='append',
+        help='Query mode: print the packages owning PATH and exit.\n' +
+        'May be given multiple times.')
+    parser.add_argument(
+        '-S', '--shared',
+        action='store_true',
+        help='Query mode: print paths owned by several packages and exit.')
+    parser.add_argument(
+        '-0', '--from0',
+        action='store_true',
+        help='File lists and command outputs are NUL-delimited.\n' +
+        'Paths are handled as bytes and passed to rsync with --from0.')
     parser.add_argument(
         '-r', '--alt-root',
         metavar='ALT_ROOT',
@@ -100,6 +201,61 @@ def main():
         nargs='?',
         default=str(),
         help='Use these arguments with rsync.')
+    parser.add_argument(
+        '-j', '--jobs',
+        metavar='JOBS',
+        type=int,
+        default=1,
+        help='Run up to JOBS rsync transfers, and up to JOBS\n' +
+        'PKG_EXEC commands, concurrently.')
+    parser.add_argument(
+        '-l', '--link',
+        metavar='LINK_MODE',
+        type=str,
+        nargs='?',
+        const=Rsync.Rsync.HARDLINK,
+        choices=[Rsync.Rsync.HARDLINK, Rsync.Rsync.REFLINK],
+        help='Rsync the main set only, then link package and orphan\n' +
+        'files from it. LINK_MODE is "hardlink" (default) or "reflink".\n' +
+        'DEST must be local.')
+    parser.add_argument(
+        '-I', '--incremental',
+        action='store_true',
+        help='Keep a manifest of the last successful run in DEST, and\n' +
+        'only pass new or changed files to rsync. SRC and DEST must be local.\n' +
+        'Files of buckets no longer synced (e.g. removed packages) are\n' +
+        'left in DEST, and reported.')
+    parser.add_argument(
+        '--storage',
+        metavar='STORAGE',
+        type=str,
+        default='set',
+        choices=sorted(STORAGE),
+        help='Store file lists in a "set" (default), in a "trie"\n' +
+        'of path components, which packs paths into buckets and uses\n' +
+        'the least memory, as a "bitmap" over a table of paths shared\n' +
+        'by all lists, or in a "sorted" list, which is written without\n' +
+        'sorting.')
+    parser.add_argument(
+        '--stats',
+        metavar='STATS_FILE',
+        type=str,
+        help='Write the wall and CPU time, path counts, processes\n' +
+        'spawned and peak RSS of each phase, with the totals of the run,\n' +
+        'to STATS_FILE as JSON.')
+    parser.add_argument(
+        '--profile',
+        metavar='PROFILE_FILE',
+        type=str,
+        help='Write a cProfile dump of the run to PROFILE_FILE.')
+    parser.add_argument(
+        '--transfer-stats',
+        metavar='TRANSFER_FILE',
+        type=str,
+        help='Run rsync with --stats --itemize-changes, and write the\n' +
+        'files and bytes transferred, duration and exit status of each\n' +
+        'transfer, with totals per bucket, to TRANSFER_FILE as JSON.\n' +
+        'The output of rsync is parsed instead of printed.')
     parser.add_argument(
         '-B', '--rsync-bin',
         metavar='RSYNC_BIN',
@@ -109,57 +265,179 @@ def main():
         help='Specify an alternative path to rsync binary.')
 
     args = parser.parse_args()
+    if args.incremental and any(map(Manifest.isRemote,
+                                    filter(None, [args.source,
+                                                  args.destination]))):
+        parser.error('--incremental requires a local SRC and DEST')
+    if (args.link and args.destination and
+            Manifest.isRemote(args.destination)):
+        parser.error('--link requires a local DEST')
+
+    stats = Stats.Stats()
+    profile = None
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        return run(args, stats)
+    except sp.CalledProcessError as err:
+        print('purrsync: {}'.format(err), file=sys.stderr)
+        return err.returncode
+    except (OSError, ValueError) as err:
+        print('purrsync: {}'.format(err), file=sys.stderr)
+        return 1
+    finally:
+        if not isinstance(profile, type(None)):
+            profile.disable()
+            profile.dump_stats(args.profile)
+        if args.stats:
+            stats.write(args.stats)
+
+
+def run(args, stats=None):
+    """
+    Builds the file sets from args, then runs rsync.
+    Each phase is recorded in stats.
+    """
+    if isinstance(stats, type(None)):
+        stats = Stats.Stats()
+    from0 = args.from0
 
     main_update = []
     if args.main_exec:
         main_update = updateIter(
-            args.main_exec)
+            args.main_exec, from0, stats)
 
     ignore_update = []
     if args.ignore_exec:
         ignore_update = updateIter(
-            args.ignore_exec)
+            args.ignore_exec, from0, stats)
 
     package_list_update = []
     if args.package_list_exec:
-        package_list_update = updateIter(
-            args.package_list_exec)
+        # Package names are always strings.
+        package_list_update = map(
+            os.fsdecode,
+            updateIter(
+                args.package_list_exec, from0, stats))
 
     pkgfn = None
     if args.package_exec:
         def pkgfn(package):
             return updateIter(
                 args.package_exec.format(
+                    package), from0, stats)
+
+    keyfn = None
+    if args.package_key_exec:
+        def keyfn(package):
+            return os.linesep.join(
+                updateIter(
+                    args.package_key_exec.format(
+                        package), stats=stats))
+    elif args.package_key_file:
+        def keyfn(package):
+            return statKey(
+                args.package_key_file.format(
                     package))
 
     root = args.source
     if args.alt_root:
         root = args.alt_root
 
-    mainSet = FileSet.FileSet(
-        setIter=input_pipe(),
-        filename=args.main_file,
-        updatefn=main_update,
-        root=root)
-    mainSet.read()
-    mainSet.fnupdate()
-
-    ignoreSet = FileSet.FileSet(
-        filename=args.ignore_file,
-        updatefn=ignore_update,
-        root=root)
-    ignoreSet.read()
-    ignoreSet.fnupdate()
+    fileset = storage(args.storage)
+    query = args.owner or args.shared
 
     packageSet = dict()
-    if args.package:
+    if args.package or query:
         packageSet = FileSet.PackageSource(
             pkglist=package_list_update,
             dirname=args.package_dir,
             pkgfn=pkgfn,
-            root=root)
-        packageSet.read()
-        packageSet.fnupdate()
+            root=root,
+            from0=from0,
+            jobs=args.jobs,
+            keyfn=keyfn,
+            fileset=fileset)
+        with stats.phase('package/read'):
+            packageSet.read()
+        with stats.phase('package/map'):
+            if args.package_map_file:
+                with open(args.package_map_file, 'rb') as f:
+                    packageSet.mapupdate(
+                        FileSet.parseMap(
+                            FileSet.readLines(f, from0)))
+            if args.package_map_exec:
+                packageSet.mapupdate(
+                    FileSet.parseMap(
+                        updateIter(args.package_map_exec, from0, stats)))
+            if args.package_db:
+                packageSet.mapupdate(
+                    PackageDB.readPackages(args.package_db,
+                                           dbdir=args.package_db_dir,
+                                           root=root,
+                                           jobs=args.jobs,
+                                           from0=from0))
+        with stats.phase('package/update') as counts:
+            packageSet.fnupdate()
+            counts['paths'] = len(packageSet.pathIndex)
+
+    if query:
+        for path in args.owner or []:
+            for pkg in sorted(packageSet.owners(path)):
+                print(pkg, path)
+        if args.shared:
+            for path, pkgs in sorted(packageSet.shared().items()):
+                for pkg in sorted(pkgs):
+                    print(pkg, os.fsdecode(path))
+        return
+
+    # Built after query mode, which only requires the packages.
+    mainSet = fileset(
+        setIter=input_pipe(from0),
+        filename=args.main_file,
+        updatefn=main_update,
+        root=root,
+        from0=from0)
+    with stats.phase('main') as counts:
+        mainSet.read()
+        mainSet.fnupdate()
+        counts['paths'] = len(mainSet)
+
+    ignoreSet = FileSet.IgnoreSet(
+        filename=args.ignore_file,
+        updatefn=ignore_update,
+        root=root,
+        from0=from0)
+    with stats.phase('ignore') as counts:
+        ignoreSet.read()
+        ignoreSet.fnupdate()
+        counts['paths'] = len(ignoreSet)
+
+    if args.scan:
+        def onerror(err):
+            print('purrsync: {}'.format(err), file=sys.stderr)
+
+        with stats.phase('scan') as counts:
+            Scanner.scan(root,
+                         mainSet,
+                         ignoreSet,
+                         include=args.scan_include,
+                         exclude=args.scan_exclude,
+                         jobs=args.jobs,
+                         onerror=onerror)
+            counts['paths'] = len(mainSet)
+
+    manifest = None
+    if args.incremental:
+        manifest = Manifest.Manifest(
+            filename=os.path.join(args.destination,
+                                  Manifest.Manifest.FILENAME),
+            source=args.source,
+            from0=from0,
+            jobs=args.jobs)
+        with stats.phase('manifest/read'):
+            manifest.read()
 
     rsyncInstance = Rsync.Rsync(source=args.source,
                                 destination=args.destination,
@@ -168,34 +446,81 @@ def main():
                                 packageSet=packageSet,
                                 rsyncBin=args.rsync_bin,
                                 rsyncArgs=args.rsync_args,
-                                backup_dir=args.backup_dir)
+                                backup_dir=args.backup_dir,
+                                jobs=args.jobs,
+                                link=args.link,
+                                from0=from0,
+                                manifest=manifest,
+                                stats=stats,
+                                transferStats=bool(args.transfer_stats))
     rsyncInstance.prepareDest(package=args.package,
                               orphan=args.orphan)
-    rsyncInstance.rsyncMain()
 
-    if args.package:
-        for pkg, proc in rsyncInstance.rsyncPackages():
-            pass
+    returncode = 0
+    for name, proc in rsyncInstance.rsyncAll(package=args.package,
+                                             orphan=args.orphan):
+        if proc.returncode:
+            print('rsync failed for {} (exit status {})'.format(
+                name, proc.returncode), file=sys.stderr)
+            returncode = proc.returncode
+    if args.transfer_stats:
+        Transfer.write(args.transfer_stats,
+                       rsyncInstance.transfers.values())
+
+    if not isinstance(manifest, type(None)):
+        buckets = [name for name, _, _ in rsyncInstance.transferList(
+            package=args.package, orphan=args.orphan)]
+        for bucket, paths in sorted(manifest.retain(buckets).items()):
+            print('purrsync: {} is no longer synced, {} paths are left '
+                  'in DEST'.format(bucket, len(paths)), file=sys.stderr)
+        with stats.phase('manifest/write'):
+            manifest.write()
+    return returncode
+
+
+def updateIter(execstring, from0=False, stats=None):
+    """
+    Generates an iterable for shell execstring.
+    Output is yielded as it is produced by the command.
+    If from0 is set, the output is split on NUL into bytes.
+    The command is counted in stats, if given.
+    Raises CalledProcessError if the command fails.
+    """
+    with sp.Popen(execstring,
+                  shell=True,
+                  stdout=sp.PIPE) as proc:
+        if not isinstance(stats, type(None)):
+            stats.spawned()
+        yield from FileSet.readLines(proc.stdout, from0)
+    if proc.returncode:
+        raise sp.CalledProcessError(proc.returncode, execstring)
+
 
-    if args.orphan:
-        rsyncInstance.rsyncOrphans()
+def statKey(pattern):
+    """ Returns a fingerprint of the files matching pattern. """
+    key = list()
+    for filename in sorted(glob.glob(pattern)):
+        st = os.stat(filename)
+        key.append('{} {} {}'.format(filename, st.st_size, st.st_mtime_ns))
+    return os.linesep.join(key)
 
 
-def updateIter(execstring):
-    """ Generates an iterable for shell execstring. """
-    proc = sp.Popen(execstring,
-                    shell=True,
-                    stdout=sp.PIPE)
-    for item in proc.stdout.read(
-    ).decode(
-        "utf-8").rstrip(
-            os.linesep).split(
-                os.linesep):
-        yield item
+def storage(name):
+    """
+    Returns the file list class of --storage name, for the file lists
+    of one run. FileBitmaps of a run share a PathTable, released with them.
+    """
+    fileset = STORAGE[name]
+    if fileset is FileBitmap.FileBitmap:
+        return functools.partial(fileset, table=FileBitmap.PathTable())
+    return fileset
 
 
-def input_pipe():
+def input_pipe(from0=False):
     if not sys.stdin.isatty():
+        if from0:
+            yield from FileSet.readLines(sys.stdin.buffer, True)
+            return
         input_stream = sys.stdin
         for line in input_stream:
             yield(
@@ -204,4 +529,4 @@ def input_pipe():
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
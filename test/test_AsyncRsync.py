@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import asyncio
+import time
+import os
+
+import purrsync.AsyncRsync as AsyncRsync
+import purrsync.FileSet as FileSet
+
+# Echoes the file list as itemized changes, fails for pkg_bad and
+# hangs for pkg_slow.
+STUB = """#!/bin/sh
+case "$*" in
+    *pkg_bad*) cat > /dev/null; exit 23;;
+    *pkg_slow*) exec sleep 10;;
+esac
+sed "s/^/>f+++++++++ /"
+echo "Total bytes sent: 100"
+"""
+
+
+class TestAsyncRsync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rsyncBin = os.path.join(self.tmp.name, 'rsync')
+        with open(self.rsyncBin, 'w') as f:
+            f.write(STUB)
+        os.chmod(self.rsyncBin, 0o755)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def rsync(self, packages, **kwargs):
+        mainSet = FileSet.FileSet(setIter=['a', 'b', 'c'], root='/')
+        packageSet = {pkg: FileSet.FileSet(setIter=['a'], root='/')
+                      for pkg in packages}
+        return AsyncRsync.AsyncRsync(destination=self.tmp.name,
+                                     mainSet=mainSet,
+                                     packageSet=packageSet,
+                                     rsyncBin=self.rsyncBin,
+                                     **kwargs)
+
+    def test_rsyncAll(self):
+        events = list()
+        lines = list()
+        rs1 = self.rsync(['pkg_{}'.format(i) for i in range(6)] +
+                         ['pkg_bad'],
+                         jobs=3,
+                         transferStats=True,
+                         onOutput=lambda name, line: lines.append(
+                             (name, line)),
+                         onEvent=lambda name, event, transfer: events.append(
+                             (name, event)))
+
+        transfers = asyncio.run(rs1.rsyncAll())
+        self.assertEqual(len(transfers), 9)
+        self.assertEqual(transfers['main']['itemized'], 3)
+        self.assertEqual(transfers['main']['bytes_sent'], 100)
+        self.assertEqual(transfers['orphan']['paths'], 2)
+        self.assertEqual(transfers['pkg/pkg_bad']['exit'], 23)
+        self.assertEqual(rs1.returncodes['pkg/pkg_0'], 0)
+        self.assertEqual(rs1.stats.spawns, 9)
+
+        self.assertIn(('main', '>f+++++++++ a'), lines)
+        self.assertIn(('pkg/pkg_bad', rs1.FAILED), events)
+        self.assertIn(('pkg/pkg_0', rs1.DONE), events)
+        # No more than 3 transfers run at once
+        running = 0
+        for name, event in events:
+            running += 1 if event == rs1.START else -1
+            self.assertLessEqual(running, 3)
+
+        pkgs = asyncio.run(rs1.rsyncPackages())
+        self.assertEqual(set(pkgs), set(rs1.packageSet))
+
+    def test_timeout(self):
+        events = list()
+        rs1 = self.rsync(['pkg_slow', 'pkg_1'],
+                         jobs=2,
+                         timeout=0.5,
+                         onEvent=lambda name, event, transfer: events.append(
+                             (name, event)))
+        start = time.perf_counter()
+        pkgs = asyncio.run(rs1.rsyncPackages())
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(pkgs['pkg_slow']['exit'], rs1.TIMEOUT_EXIT)
+        self.assertEqual(pkgs['pkg_1']['exit'], 0)
+        self.assertIn(('pkg/pkg_slow', rs1.TIMEOUT), events)
+
+    def test_cancel(self):
+        events = list()
+        rs1 = self.rsync(['pkg_slow'],
+                         onEvent=lambda name, event, transfer: events.append(
+                             (name, event)))
+
+        async def cancel():
+            task = asyncio.ensure_future(rs1.rsyncPackages())
+            await asyncio.sleep(0.5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.perf_counter()
+        asyncio.run(cancel())
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(events[-1], ('pkg/pkg_slow', rs1.CANCELLED))
+        self.assertEqual(rs1.returncodes['pkg/pkg_slow'], -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import time
+import os
+
+import purrsync.FileSet as FileSet
+import purrsync.FileArray as FileArray
+import purrsync.Scanner as Scanner
+
+
+class TestFileArray(unittest.TestCase):
+    def test_merge(self):
+        a = ['a', 'c', 'e', 'g']
+        b = ['b', 'c', 'g', 'h']
+        self.assertEqual(FileArray.union(a, b),
+                         ['a', 'b', 'c', 'e', 'g', 'h'])
+        self.assertEqual(FileArray.intersection(a, b), ['c', 'g'])
+        self.assertEqual(FileArray.difference(a, b), ['a', 'e'])
+        self.assertEqual(FileArray.union(a, []), a)
+        self.assertEqual(FileArray.intersection(a, ['x']), [])
+        self.assertEqual(FileArray.search(['c', 'd'], a), ['c'])
+        self.assertTrue(FileArray.isSorted(a))
+        self.assertFalse(FileArray.isSorted(['a', 'a']))
+
+    def test_SetOperators(self):
+        paths1 = ['/etc/a', '/etc/sub/c', '/var/d']
+        paths2 = ['/etc/a', '/etc/sub/e', '/usr/f']
+        fa1 = FileArray.FileArray(setIter=paths1, root='/')
+        fa2 = FileArray.FileArray(setIter=paths2, root='/')
+        fs1 = FileSet.FileSet(setIter=paths1, root='/')
+        fs2 = FileSet.FileSet(setIter=paths2, root='/')
+
+        self.assertEqual(len(fa1), 3)
+        self.assertIn('/etc/sub/c', fa1)
+        self.assertNotIn('/etc/sub/e', fa1)
+        self.assertNotIn('/tmp/etc/a', fa1)
+
+        for op in ['union', 'intersection', 'difference']:
+            expected = getattr(fs1, op)(fs2)
+            self.assertEqual(getattr(fa1, op)(fa2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(fa1, op)(fs2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(fs1, op)(fa2), expected)
+
+        fa1.discard('/etc/a')
+        self.assertEqual(list(fa1), ['etc/sub/c', 'var/d'])
+        with self.assertRaises(KeyError):
+            fa1.remove('/etc/a')
+
+    def test_pending(self):
+        fa1 = FileArray.FileArray(setIter=['/b', '/a', '/b'], root='/')
+        fa1.add('/c')
+        fa1.add('/a')
+        self.assertTrue(fa1.hasKey('c'))
+        self.assertEqual(list(fa1), ['a', 'b', 'c'])
+
+        # Sorted input is merged, unsorted input added as pending.
+        fa1.update(['/0', '/d'])
+        fa1.update(['/f', '/e'])
+        self.assertEqual(fa1.keys(), ['0', 'a', 'b', 'c', 'd', 'e', 'f'])
+
+    def test_root(self):
+        fa1 = FileArray.FileArray(setIter=['./a', 'sub/b'], root='/etc')
+        fa0 = FileArray.FileArray(root='/')
+        self.assertEqual(list(fa0 | fa1), ['etc/a', 'etc/sub/b'])
+
+        fa1.root = '/'
+        self.assertEqual(list(fa1), ['etc/a', 'etc/sub/b'])
+
+    def test_FileOps(self):
+        with tempfile.NamedTemporaryFile(mode='rb') as fp:
+            fa1 = FileArray.FileArray(setIter=[b'/etc/\xff', b'/etc/a'],
+                                      filename=fp.name, root='/',
+                                      from0=True)
+            fa1.write()
+            self.assertEqual(fp.read(), b'etc/a\0etc/\xff')
+
+            fa2 = FileArray.FileArray(filename=fp.name, root='/',
+                                      from0=True)
+            fa2.read()
+            self.assertEqual(fa1, fa2)
+
+    def test_PackageSource(self):
+        ps = FileSet.PackageSource(root='/', fileset=FileArray.FileArray)
+        ps.mapupdate(FileSet.parseMap(['pkg1 /etc/a', 'pkg2 /etc/a',
+                                       'pkg2 /etc/b']))
+        mainSet = FileArray.FileArray(setIter=['/etc/a', '/etc/c'],
+                                      root='/')
+        self.assertEqual((mainSet & ps['pkg2']).__set__(), set({'etc/a'}))
+        self.assertEqual((mainSet - ps.ownedSet()).__set__(), set({'etc/c'}))
+
+    def test_load(self):
+        """ Tests loading key by key is not quadratic. """
+        paths = ['/etc/{:05d}'.format(i) for i in range(20000)]
+        start = time.perf_counter()
+        ps = FileSet.PackageSource(root='/', fileset=FileArray.FileArray)
+        ps.mapupdate(('pkg1', path) for path in paths)
+        self.assertEqual(len(ps['pkg1']), len(paths))
+        self.assertEqual(ps['pkg1'].keys()[:2], ['etc/00000', 'etc/00001'])
+        self.assertLess(time.perf_counter() - start, 5)
+
+        with tempfile.TemporaryDirectory() as src:
+            for i in range(2000):
+                os.makedirs(os.path.join(src, 'd{}'.format(i % 200),
+                                         'e{}'.format(i)))
+            start = time.perf_counter()
+            mainSet = FileArray.FileArray(root=src)
+            Scanner.scan(src, mainSet)
+            self.assertEqual(len(mainSet), 2200)
+            self.assertTrue(FileArray.isSorted(mainSet.keys()))
+            self.assertIn(os.path.join(src, 'd0', 'e0'), mainSet)
+            self.assertLess(time.perf_counter() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
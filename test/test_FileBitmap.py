@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+
+import purrsync.FileSet as FileSet
+import purrsync.FileBitmap as FileBitmap
+
+
+class TestFileBitmap(unittest.TestCase):
+    def test_bitmap(self):
+        ids = [0, 3, 8, 9, 100]
+        bits = FileBitmap.bitmap(ids)
+        self.assertEqual(bits, sum(1 << i for i in ids))
+        self.assertEqual(list(FileBitmap.members(bits)), ids)
+        self.assertEqual(FileBitmap.bitmap([]), 0)
+        self.assertEqual(list(FileBitmap.members(0)), [])
+        ids = [7, 8, 1 << 20, (1 << 20) + 1]
+        self.assertEqual(list(FileBitmap.members(FileBitmap.bitmap(ids))),
+                         ids)
+
+        # Keys added one at a time are merged in batches.
+        fb1 = FileBitmap.FileBitmap(root='/')
+        for i in range(FileBitmap.PENDING + 10):
+            fb1.add('/f{}'.format(i))
+        fb1.discard('/f3')
+        self.assertEqual(len(fb1), FileBitmap.PENDING + 9)
+        self.assertNotIn('/f3', fb1)
+        self.assertIn('/f{}'.format(FileBitmap.PENDING + 9), fb1)
+        self.assertEqual(FileBitmap.count(fb1.bits), len(fb1))
+
+        # Members are tested against the current bits.
+        fb1.add('/f3')
+        self.assertIn('/f3', fb1)
+        fb1.clear()
+        self.assertNotIn('/f3', fb1)
+        self.assertEqual(len(fb1), 0)
+
+    def test_SetOperators(self):
+        table = FileBitmap.PathTable()
+        paths1 = ['/etc/a', '/etc/sub/c', '/var/d']
+        paths2 = ['/etc/a', '/etc/sub/e', '/usr/f']
+        fb1 = FileBitmap.FileBitmap(setIter=paths1, root='/', table=table)
+        fb2 = FileBitmap.FileBitmap(setIter=paths2, root='/', table=table)
+        fs1 = FileSet.FileSet(setIter=paths1, root='/')
+        fs2 = FileSet.FileSet(setIter=paths2, root='/')
+
+        # Each path is stored once in the table.
+        self.assertEqual(len(table), 5)
+        self.assertIs(fb1.table, fb2.table)
+        self.assertEqual(len(fb1), 3)
+        self.assertIn('/etc/sub/c', fb1)
+        self.assertNotIn('/etc/sub/e', fb1)
+        self.assertNotIn('/tmp/etc/a', fb1)
+
+        for op in ['union', 'intersection', 'difference']:
+            expected = getattr(fs1, op)(fs2)
+            self.assertEqual(getattr(fb1, op)(fb2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(fb1, op)(fs2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(fs1, op)(fb2), expected)
+
+        # Only union adds paths to the table.
+        fb1 & FileSet.FileSet(setIter=['/tmp/x'], root='/')
+        self.assertEqual(len(table), 5)
+
+        fb1.discard('/etc/a')
+        self.assertEqual(fb1.__set__(), set({'etc/sub/c', 'var/d'}))
+        with self.assertRaises(KeyError):
+            fb1.remove('/etc/a')
+
+    def test_root(self):
+        fb1 = FileBitmap.FileBitmap(setIter=['./a', 'sub/b'], root='/etc')
+        fb0 = FileBitmap.FileBitmap(root='/')
+        self.assertEqual((fb0 | fb1).__set__(), set({'etc/a', 'etc/sub/b'}))
+
+        fb1.root = '/'
+        self.assertIsNot(fb1.table, fb0.table)
+        self.assertEqual(fb1.__set__(), set({'etc/a', 'etc/sub/b'}))
+        self.assertEqual(fb1, FileBitmap.FileBitmap(
+            setIter=['/etc/sub/b', '/etc/a'], root='/'))
+
+    def test_FileOps(self):
+        with tempfile.NamedTemporaryFile(mode='rb') as fp:
+            fb1 = FileBitmap.FileBitmap(setIter=[b'/etc/\xff', b'/etc/a'],
+                                        filename=fp.name, root='/',
+                                        from0=True)
+            fb1.write()
+            self.assertEqual(fp.read(), b'etc/a\0etc/\xff')
+
+            fb2 = FileBitmap.FileBitmap(filename=fp.name, root='/',
+                                        from0=True)
+            fb2.read()
+            self.assertEqual(fb1, fb2)
+
+    def test_PackageSource(self):
+        ps = FileSet.PackageSource(root='/', fileset=FileBitmap.FileBitmap)
+        ps.mapupdate(FileSet.parseMap(['pkg1 /etc/a', 'pkg2 /etc/a',
+                                       'pkg2 /etc/b']))
+        mainSet = FileBitmap.FileBitmap(setIter=['/etc/a', '/etc/c'],
+                                        root='/')
+        self.assertEqual((mainSet & ps['pkg2']).__set__(), set({'etc/a'}))
+        self.assertEqual((mainSet - ps.ownedSet()).__set__(), set({'etc/c'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
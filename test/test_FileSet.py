@@ -4,9 +4,14 @@
 
 import unittest
 import tempfile
+import io
 import os
+import threading
 import subprocess as sp
 import purrsync.FileSet as FileSet
+import purrsync.FileTrie as FileTrie
+import purrsync.FileBitmap as FileBitmap
+import purrsync.FileArray as FileArray
 
 
 class TestFileSet(unittest.TestCase):
@@ -70,6 +75,37 @@ class TestFileSet(unittest.TestCase):
         self.assertEqual(fs3.__set__(), fs4.__set__())
         self.assertEqual(fs3, fs4)
 
+    def test_CanonicalKeys(self):
+        fs1 = FileSet.FileSet(setIter=['/etc/fstab', './hosts', 'a/../b'],
+                              root='/etc')
+        self.assertEqual(fs1.__set__(), set({'fstab', 'hosts', 'b'}))
+        self.assertIn('/etc/hosts', fs1)
+        self.assertIn('hosts', fs1)
+        self.assertNotIn('/var/hosts', fs1)
+        fs1.discard('/var/hosts')
+        self.assertEqual(len(fs1), 3)
+
+        fs2 = fs1.copy()
+        fs2.root = '/'
+        self.assertEqual(fs2.__set__(),
+                         set({'etc/fstab', 'etc/hosts', 'etc/b'}))
+        self.assertEqual(fs2.normpath(), fs1.normpath())
+
+        with self.assertRaises(ValueError):
+            FileSet.FileSet(setIter=['/etcfoo/hosts'], root='/etc')
+
+    def test_UpdateOverRoot(self):
+        fs1 = FileSet.FileSet(setIter=['/etc/fstab'], root='/etc')
+        for storage in [FileSet.FileSet, FileTrie.FileTrie,
+                        FileBitmap.FileBitmap, FileArray.FileArray]:
+            fl1 = storage(setIter=fs1, root='/')
+            self.assertEqual(fl1.normpath(), set({'/etc/fstab'}))
+            fl2 = storage(root='/')
+            fl2.update(fs1)
+            self.assertEqual(fl2.normpath(), set({'/etc/fstab'}))
+        fs2 = FileSet.FileSet(setIter=fs1)
+        self.assertEqual(fs2.__set__(), set({'/etc/fstab'}))
+
     def test_FileOps(self):
         with tempfile.NamedTemporaryFile(mode='r',
                                          newline=os.linesep) as fp:
@@ -83,6 +119,54 @@ class TestFileSet(unittest.TestCase):
             expectedString = fp.read()
             self.assertEqual(expectedString, 'anotherfile.txt\nsomefile.txt')
 
+    def test_from0(self):
+        with tempfile.NamedTemporaryFile(mode='rb') as fp:
+            paths = [b'./new\nline', b'/etc/\xff', b'/etc/sub/../a']
+            fs1 = FileSet.FileSet(setIter=paths, filename=fp.name,
+                                  root='/etc', from0=True)
+            self.assertEqual(fs1.__set__(), set({b'new\nline', b'\xff', b'a'}))
+            self.assertIn('/etc/a', fs1)
+            fs1.write()
+            self.assertEqual(fp.read(), b'a\0new\nline\0\xff')
+
+            fs2 = FileSet.FileSet(filename=fp.name, root='/etc', from0=True)
+            self.assertIn(b'/etc/new\nline', fs2.read())
+            self.assertEqual(fs1, fs2)
+
+            fs2.updatefn = ['somefile.txt']
+            with self.assertRaises(TypeError):
+                fs2.fnupdate()
+
+    def test_readLines(self):
+        text = os.linesep.join(['first', 'second', '', 'thi\xefrd'])
+        stream = io.BytesIO(text.encode('utf-8'))
+        self.assertEqual(list(FileSet.readLines(stream, chunksize=3)),
+                         ['first', 'second', 'thi\xefrd'])
+
+        stream = io.BytesIO(b'a\nb\0\xff\0\0c')
+        self.assertEqual(list(FileSet.readLines(stream, from0=True,
+                                                chunksize=2)),
+                         [b'a\nb', b'\xff', b'c'])
+
+    def test_view(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write(os.linesep.join(['/etc/a', '/etc/sub/../b', '/etc/a']))
+            fp.flush()
+            fs1 = FileSet.FileSet(filename=fp.name, root='/etc')
+            view = fs1.read()
+        self.assertIsInstance(view, FileSet.PathView)
+        self.assertEqual(view, fs1.normpath())
+        self.assertEqual(len(view), 2)
+        self.assertIn('/etc/sub/../a', view)
+        self.assertNotIn('/var/a', view)
+
+        # The view follows the set.
+        fs1.add('/etc/c')
+        self.assertIn('/etc/c', view)
+        self.assertEqual(view | {'/etc/d'},
+                         set({'/etc/a', '/etc/b', '/etc/c', '/etc/d'}))
+        self.assertEqual(view - {'/etc/a'}, set({'/etc/b', '/etc/c'}))
+
     def test_FileClobber(self):
         with tempfile.NamedTemporaryFile(mode='r',
                                          newline=os.linesep) as fp:
@@ -132,7 +216,253 @@ class TestFileSet(unittest.TestCase):
         self.assertEqual(len(fs1.read()), 1)
 
 
+    def test_FileList(self):
+        paths = [b'/etc/b', b'/etc/a', b'/var/c']
+        fs1 = FileSet.FileSet(setIter=paths[1:2], root='/etc', from0=True)
+        for storage in [FileSet.FileSet, FileTrie.FileTrie,
+                        FileBitmap.FileBitmap, FileArray.FileArray]:
+            with self.assertRaises(ValueError):
+                storage(setIter=paths, root='/etc', from0=True)
+            fl1 = storage(setIter=paths[:2], root='/etc', from0=True)
+            self.assertIsInstance(fl1, FileSet.FileList)
+            self.assertIn('/etc/a', fl1)
+            self.assertNotIn(b'/var/c', fl1)
+            self.assertEqual(fl1 & fs1, fs1)
+            self.assertEqual((fl1 - fs1).__set__(), set({b'b'}))
+            self.assertEqual(fl1 | fs1, fl1)
+            self.assertNotEqual(fl1, set(fl1))
+            fl1.updatefn = ['/etc/c']
+            with self.assertRaises(TypeError):
+                fl1.fnupdate()
+            fl1.updatefn = None
+
+            fl1.root = '/'
+            self.assertEqual(fl1.normpath(), set({b'/etc/a', b'/etc/b'}))
+            fl1.discard('/var/c')
+            fl1.remove('/etc/a')
+            with self.assertRaises(KeyError):
+                fl1.remove('/etc/a')
+            self.assertEqual(list(fl1), [b'etc/b'])
+
+
+class TestIgnoreSet(unittest.TestCase):
+    def test_rules(self):
+        with tempfile.NamedTemporaryFile(mode='w') as fp:
+            fp.write(os.linesep.join(['/etc/fstab',
+                                      'glob:*.key',
+                                      'glob:ssl/*.pem',
+                                      're:~$',
+                                      '/etc/cache/']))
+            fp.flush()
+            ignoreSet = FileSet.IgnoreSet(filename=fp.name, root='/etc')
+            ignoreSet.read()
+            self.assertEqual(ignoreSet.__set__(), set({'fstab'}))
+            self.assertTrue(ignoreSet.prunes('/etc/cache/sub'))
+            self.assertFalse(ignoreSet.prunes('/etc/cachefile'))
+
+            mainSet = FileSet.FileSet(setIter=['fstab', 'a.key', 'hosts',
+                                               'hosts~', 'ssl/b.pem',
+                                               'pem/c.pem', 'cache',
+                                               'cache/x', 'cachefile'],
+                                      root='/etc')
+            self.assertEqual((mainSet - ignoreSet).__set__(),
+                             set({'hosts', 'pem/c.pem', 'cachefile'}))
+
+            # Rules match relative to the root of the IgnoreSet.
+            mainSet.root = '/'
+            self.assertEqual((mainSet - ignoreSet).normpath(),
+                             set({'/etc/hosts', '/etc/pem/c.pem',
+                                  '/etc/cachefile'}))
+
+    def test_outsideRoot(self):
+        ignoreSet = FileSet.IgnoreSet(root='/etc')
+        self.assertTrue(ignoreSet.addRule('/var/cache/'))
+        self.assertTrue(ignoreSet.addRule('/etc/cache/'))
+        self.assertFalse(ignoreSet.prunes('/var/cache/x'))
+        self.assertTrue(ignoreSet.prunes('/etc/cache/x'))
+        mainSet = FileSet.FileSet(setIter=['cache/x', 'hosts'], root='/etc')
+        self.assertEqual((mainSet - ignoreSet).__set__(), set({'hosts'}))
+
+    def test_from0(self):
+        ignoreSet = FileSet.IgnoreSet(root='/', from0=True)
+        for line in [b'glob:*.\xff', b're:^tmp/', b'var/cache/']:
+            self.assertTrue(ignoreSet.addRule(line))
+        self.assertFalse(ignoreSet.addRule(b'etc/fstab'))
+        mainSet = FileSet.FileSet(setIter=[b'/a.\xff', b'/tmp/b',
+                                           b'/var/cache/c', b'/var/d'],
+                                  root='/', from0=True)
+        self.assertEqual((mainSet - ignoreSet).__set__(), set({b'var/d'}))
+
+
 class TestPackageSource(unittest.TestCase):
+    def test_pathIndex(self):
+        with tempfile.TemporaryDirectory() as pkgdir:
+            os.mkdir(os.path.join(pkgdir, 'cat'))
+            for pkg, files in [('cat/pkg1', ['/etc/a', '/etc/b']),
+                               ('cat/pkg2', ['/etc/b', '/etc/c'])]:
+                with open(os.path.join(pkgdir, pkg), 'w') as f:
+                    f.write(os.linesep.join(files))
+
+            ps = FileSet.PackageSource(dirname=pkgdir, root='/')
+            ps.read()
+
+            self.assertEqual(ps.owners('/etc/a'), set({'cat/pkg1'}))
+            self.assertEqual(ps.owners('etc/b'),
+                             set({'cat/pkg1', 'cat/pkg2'}))
+            self.assertEqual(ps.owners('/etc/d'), set())
+            self.assertEqual(ps.shared(),
+                             {'/etc/b': set({'cat/pkg1', 'cat/pkg2'})})
+            self.assertEqual(ps.ownedSet(),
+                             FileSet.FileSet(setIter=['/etc/a', '/etc/b',
+                                                      '/etc/c'],
+                                             root='/'))
+
+            # A single owner is stored without a set.
+            self.assertEqual(ps.pathIndex['etc/a'], 'cat/pkg1')
+
+            ps.remove('cat/pkg1')
+            self.assertEqual(ps.owners('/etc/a'), set())
+            self.assertEqual(ps.shared(), dict())
+            self.assertEqual(ps.pathIndex['etc/b'], 'cat/pkg2')
+
+            ps.mapupdate([('cat/pkg3', '/etc/b'), ('cat/pkg3', '/etc/d')])
+            self.assertEqual(ps.owners('/etc/b'),
+                             set({'cat/pkg2', 'cat/pkg3'}))
+            self.assertEqual(ps.owners('/etc/d'), set({'cat/pkg3'}))
+
+    def test_jobs(self):
+        barrier = threading.Barrier(4)
+
+        def pkgfn(pkg):
+            # Completes only if all packages are updated concurrently.
+            barrier.wait(timeout=10)
+            yield '/etc/{}.conf'.format(pkg)
+
+        ps = FileSet.PackageSource(pkglist=['a', 'b', 'c', 'd'],
+                                   pkgfn=pkgfn,
+                                   root='/',
+                                   jobs=4)
+        ps.fnupdate()
+        for pkg in ['a', 'b', 'c', 'd']:
+            self.assertEqual(ps[pkg].__set__(),
+                             set({'etc/{}.conf'.format(pkg)}))
+        self.assertEqual(ps.owners('/etc/a.conf'), set({'a'}))
+
+    def test_cache(self):
+        calls = list()
+        versions = {'cat/pkg1': '1.0', 'cat/pkg2': '2.0'}
+
+        def pkgfn(pkg):
+            def update():
+                calls.append(pkg)
+                yield '/etc/{}-{}'.format(pkg, versions[pkg])
+            return update()
+
+        def source(pkgdir, root='/', from0=False):
+            fn = pkgfn
+            if from0:
+                def fn(pkg):
+                    return map(os.fsencode, pkgfn(pkg))
+            ps = FileSet.PackageSource(pkglist=sorted(versions),
+                                       dirname=pkgdir,
+                                       pkgfn=fn,
+                                       root=root,
+                                       from0=from0,
+                                       keyfn=versions.get)
+            ps.read()
+            ps.fnupdate()
+            return ps
+
+        with tempfile.TemporaryDirectory() as pkgdir:
+            source(pkgdir)
+            self.assertEqual(sorted(calls), ['cat/pkg1', 'cat/pkg2'])
+
+            # Unchanged packages are read from the cache.
+            ps = source(pkgdir)
+            self.assertEqual(len(calls), 2)
+            self.assertIn('/etc/cat/pkg1-1.0', ps['cat/pkg1'])
+
+            versions['cat/pkg1'] = '1.1'
+            ps = source(pkgdir)
+            self.assertEqual(calls[2:], ['cat/pkg1'])
+            self.assertEqual(ps['cat/pkg1'].normpath(),
+                             set({'/etc/cat/pkg1-1.1'}))
+            self.assertEqual(ps.owners('/etc/cat/pkg2-2.0'),
+                             set({'cat/pkg2'}))
+
+            # Cached lists are relative to root, another root updates all.
+            ps = source(pkgdir, root='/etc')
+            self.assertEqual(sorted(calls[3:]), ['cat/pkg1', 'cat/pkg2'])
+            self.assertEqual(ps['cat/pkg2'].normpath(),
+                             set({'/etc/cat/pkg2-2.0'}))
+
+            # Cached lists are delimited by -0, switching it updates all.
+            ps = source(pkgdir, root='/etc', from0=True)
+            self.assertEqual(sorted(calls[5:]), ['cat/pkg1', 'cat/pkg2'])
+            self.assertEqual(ps.owners(b'/etc/cat/pkg2-2.0'),
+                             set({'cat/pkg2'}))
+            ps = source(pkgdir, root='/etc')
+            self.assertEqual(sorted(calls[7:]), ['cat/pkg1', 'cat/pkg2'])
+            self.assertEqual(ps.owners('/etc/cat/pkg2-2.0'),
+                             set({'cat/pkg2'}))
+
+            # Lists of removed packages are removed from the cache.
+            del versions['cat/pkg2']
+            source(pkgdir, root='/etc')
+            self.assertFalse(os.path.exists(os.path.join(pkgdir, 'cat',
+                                                         'pkg2')))
+            ps = FileSet.PackageSource(dirname=pkgdir, root='/etc')
+            ps.read()
+            self.assertEqual(sorted(ps), ['cat/pkg1'])
+
+    def test_mapupdate(self):
+        lines = ['cat/pkg1 /etc/a',
+                 'cat/pkg1 /etc/with space',
+                 'pkg2: /etc/a',
+                 'base-files, bash: /etc',
+                 'libc6:amd64: /etc/ld.so.conf.d',
+                 'diversion by dash from: /bin/sh',
+                 'diversion by dash to: /bin/sh.distrib',
+                 'malformed']
+        ps = FileSet.PackageSource(root='/')
+        ps.mapupdate(FileSet.parseMap(lines))
+
+        self.assertEqual(sorted(ps), ['base-files', 'bash', 'cat/pkg1',
+                                      'libc6:amd64', 'pkg2'])
+        self.assertEqual(ps['cat/pkg1'].__set__(),
+                         set({'etc/a', 'etc/with space'}))
+        self.assertEqual(ps.owners('/etc/a'), set({'cat/pkg1', 'pkg2'}))
+        self.assertEqual(ps.owners('/etc'), set({'base-files', 'bash'}))
+        self.assertEqual(ps.owners('/bin/sh'), set())
+
+        ps0 = FileSet.PackageSource(root='/', from0=True)
+        ps0.mapupdate(FileSet.parseMap([b'pkg3 /etc/\xff']))
+        self.assertEqual(ps0.owners(b'/etc/\xff'), set({'pkg3'}))
+
+        # Packages from the map are not updated with pkgfn, in cache mode.
+        calls = list()
+
+        def pkgfn(pkg):
+            def update():
+                calls.append(pkg)
+                yield '/etc/{}'.format(pkg)
+            return update()
+
+        with tempfile.TemporaryDirectory() as pkgdir:
+            ps = FileSet.PackageSource(pkglist=['cat/pkg2'],
+                                       dirname=pkgdir,
+                                       pkgfn=pkgfn,
+                                       root='/',
+                                       keyfn=str)
+            ps.read()
+            ps.mapupdate(FileSet.parseMap(lines[:2]))
+            ps.fnupdate()
+            self.assertEqual(calls, ['cat/pkg2'])
+            self.assertEqual(ps['cat/pkg1'].__set__(),
+                             set({'etc/a', 'etc/with space'}))
+            self.assertEqual(ps.owners('/etc/cat/pkg2'), set({'cat/pkg2'}))
+            self.assertEqual(set(ps.fingerprints), set({'cat/pkg2'}))
+
     def test_qfile(self):
         def qfile(src):
             with sp.Popen(["qfile {} | awk '{{print $1}}'".format(src)],
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+
+import purrsync.FileSet as FileSet
+import purrsync.FileTrie as FileTrie
+
+
+class TestFileTrie(unittest.TestCase):
+    def test_SetOperators(self):
+        paths1 = ['/etc/a', '/etc/a.d/b', '/etc/sub/c', '/var/d']
+        paths2 = ['/etc/a', '/etc/sub/e', '/usr/f']
+        ft1 = FileTrie.FileTrie(setIter=paths1, root='/')
+        ft2 = FileTrie.FileTrie(setIter=paths2, root='/')
+        fs1 = FileSet.FileSet(setIter=paths1, root='/')
+        fs2 = FileSet.FileSet(setIter=paths2, root='/')
+
+        self.assertEqual(len(ft1), 4)
+        self.assertIn('/etc/sub/c', ft1)
+        self.assertIn('etc/sub/c', ft1)
+        self.assertNotIn('/etc/sub', ft1)
+        self.assertNotIn('/tmp/etc/a', FileTrie.FileTrie(['a'], root='/etc'))
+
+        for op in ['union', 'intersection', 'difference']:
+            expected = getattr(fs1, op)(fs2)
+            self.assertEqual(getattr(ft1, op)(ft2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(ft1, op)(fs2).__set__(),
+                             expected.__set__())
+            self.assertEqual(getattr(fs1, op)(ft2), expected)
+        self.assertEqual(len(ft1 | ft2), 6)
+        self.assertEqual(len(ft1 - ft2), 3)
+
+        # A FileSet compares equal to a FileTrie of the same keys.
+        self.assertEqual(fs1, ft1)
+        self.assertNotEqual(fs1, ft2)
+        self.assertNotEqual(fs1, fs1.__set__())
+
+        # Keys iterate in sorted order.
+        self.assertEqual(list(ft1),
+                         ['etc/a', 'etc/a.d/b', 'etc/sub/c', 'var/d'])
+
+        ft1.discard('/etc/a.d/b')
+        ft1.discard('/etc/missing')
+        self.assertEqual(len(ft1), 3)
+        self.assertEqual(ft1, FileTrie.FileTrie(
+            setIter=['/etc/a', '/etc/sub/c', '/var/d'], root='/'))
+        with self.assertRaises(KeyError):
+            ft1.remove('/etc/a.d/b')
+
+    def test_root(self):
+        ft1 = FileTrie.FileTrie(setIter=['./a', 'sub/b'], root='/etc')
+        ft0 = FileTrie.FileTrie(root='/')
+        self.assertEqual((ft0 | ft1).__set__(), set({'etc/a', 'etc/sub/b'}))
+
+        ft1.root = '/'
+        self.assertEqual(ft1.__set__(), set({'etc/a', 'etc/sub/b'}))
+        with self.assertRaises(ValueError):
+            FileTrie.FileTrie(setIter=['/var/a'], root='/etc')
+
+    def test_subtree(self):
+        ft1 = FileTrie.FileTrie(setIter=['/etc/portage/make.conf',
+                                         '/etc/portage/repos.conf/gentoo',
+                                         '/etc/portage.bak', '/etc/fstab'],
+                                root='/')
+        self.assertEqual(ft1.subtree('/etc/portage').normpath(),
+                         set({'/etc/portage/make.conf',
+                              '/etc/portage/repos.conf/gentoo'}))
+        self.assertEqual(len(ft1.subtree('/etc')), 4)
+        self.assertEqual(len(ft1.subtree('/var')), 0)
+
+    def test_buckets(self):
+        # Deep directories are burst into nodes, flat ones are kept in
+        # large buckets.
+        paths = ['/{}/{}-{}/f{}'.format(d, d, i % 7, i)
+                 for d in ['a', 'a-b', 'a.d'] for i in range(2000)]
+        paths.extend('/flat/f{:05d}'.format(i) for i in range(3000))
+        ft1 = FileTrie.FileTrie(setIter=paths, root='/')
+        fs1 = FileSet.FileSet(setIter=paths, root='/')
+        self.assertEqual(list(ft1), sorted(fs1))
+        self.assertIn('/flat/f02999', ft1)
+        self.assertNotIn('/flat/f3', ft1)
+        self.assertIn('/a-b/a-b-3/f3', ft1)
+        self.assertEqual(ft1.subtree('/a').__set__(),
+                         set(key for key in fs1 if key.startswith('a/')))
+
+        for i in range(0, 6000, 2):
+            ft1.add('/new/{}'.format(i))
+        ft1.discardKeys(key for key in fs1 if key.startswith('a.d/'))
+        self.assertEqual(len(ft1), 10000)
+        self.assertEqual(list(ft1), sorted(ft1.__set__()))
+
+        # Set operations stream the sorted keys of both sides.
+        ft2 = FileTrie.FileTrie(setIter=paths[::3], root='/')
+        fs2 = FileSet.FileSet(setIter=paths[::3], root='/')
+        for other in [ft2, fs2, paths[::3]]:
+            self.assertEqual((ft1 & other).__set__(),
+                             ft1.__set__() & fs2.__set__())
+            self.assertEqual((ft1 - other).__set__(),
+                             ft1.__set__() - fs2.__set__())
+        self.assertEqual(ft1.intersection(ft2, ft1).__set__(),
+                         ft1.__set__() & fs2.__set__())
+        self.assertEqual(list(ft1.difference(ft2, fs1)),
+                         sorted(ft1.__set__() - fs2.__set__() -
+                                fs1.__set__()))
+
+    def test_FileOps(self):
+        with tempfile.NamedTemporaryFile(mode='rb') as fp:
+            ft1 = FileTrie.FileTrie(setIter=[b'/etc/new\nline', b'/etc/\xff'],
+                                    filename=fp.name, root='/', from0=True)
+            ft1.write()
+            self.assertEqual(fp.read(), b'etc/new\nline\0etc/\xff')
+
+            ft2 = FileTrie.FileTrie(filename=fp.name, root='/', from0=True)
+            ft2.read()
+            self.assertEqual(ft1, ft2)
+            self.assertIn('/etc/\udcff', ft2)
+
+    def test_PackageSource(self):
+        ps = FileSet.PackageSource(root='/', fileset=FileTrie.FileTrie)
+        ps.mapupdate(FileSet.parseMap(['pkg1 /etc/a', 'pkg2 /etc/a',
+                                       'pkg2 /etc/b']))
+        self.assertIsInstance(ps['pkg1'], FileTrie.FileTrie)
+        self.assertIsInstance(ps.ownedSet(), FileTrie.FileTrie)
+        self.assertEqual(ps.shared(), {'/etc/a': set({'pkg1', 'pkg2'})})
+
+        ignoreSet = FileSet.IgnoreSet(root='/')
+        ignoreSet.addRule('glob:b')
+        self.assertEqual((ps.ownedSet() - ignoreSet).__set__(),
+                         set({'etc/a'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
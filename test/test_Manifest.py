@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import os
+
+import purrsync.Manifest as Manifest
+import purrsync.Rsync as Rsync
+import purrsync.FileSet as FileSet
+
+
+class TestManifest(unittest.TestCase):
+    def test_Manifest(self):
+        with tempfile.TemporaryDirectory() as src:
+            for name in ['a', 'b', 'c']:
+                with open(os.path.join(src, name), 'w') as f:
+                    f.write(name)
+            filename = os.path.join(src, Manifest.Manifest.FILENAME)
+
+            m1 = Manifest.Manifest(filename=filename, source=src, jobs=2)
+            m1.read()
+            self.assertEqual(m1.changed('main', ['a', 'b']), ['a', 'b'])
+            m1.update('main', ['a', 'b', 'missing'])
+            m1.write()
+
+            m2 = Manifest.Manifest(filename=filename, source=src)
+            m2.read()
+            self.assertEqual(m1, m2)
+            self.assertNotIn('missing', m2['main'])
+            self.assertEqual(m2.changed('main', ['a', 'b', 'c']), ['c'])
+
+            with open(os.path.join(src, 'a'), 'w') as f:
+                f.write('changed')
+            m3 = Manifest.Manifest(filename=filename, source=src)
+            m3.read()
+            self.assertEqual(m3.changed('main', ['a', 'b']), ['a'])
+            self.assertEqual(m3.moved('main', ['a'], ['a', 'b']), ['b'])
+
+            # Buckets which are no longer synced are dropped.
+            m3.update('pkg/removed', ['c'])
+            self.assertEqual(m3.retain(['main']), {'pkg/removed': ['c']})
+            self.assertEqual(set(m3), set({'main'}))
+            self.assertEqual(m3.changed('pkg/removed', ['c']), ['c'])
+
+        # Remote sources cannot be stat'ed.
+        self.assertTrue(Manifest.isRemote('host:/etc'))
+        self.assertFalse(Manifest.isRemote('/etc'))
+        with self.assertRaises(ValueError):
+            Manifest.Manifest(source='host:/etc').stat(['a'])
+
+    def test_incremental(self):
+        """ Tests incremental runs with a stub rsync binary. """
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'src')
+            dest = os.path.join(tmp, 'dest')
+            os.mkdir(src)
+            os.mkdir(dest)
+            for name in ['a', 'b']:
+                with open(os.path.join(src, name), 'w') as f:
+                    f.write(name)
+
+            rsyncBin = os.path.join(tmp, 'rsync')
+            listFile = os.path.join(tmp, 'list')
+            with open(rsyncBin, 'w') as f:
+                f.write('#!/bin/sh\n' +
+                        'cat >> {}\n'.format(listFile))
+            os.chmod(rsyncBin, 0o755)
+
+            def run(packaged):
+                if os.path.exists(listFile):
+                    os.remove(listFile)
+                manifest = Manifest.Manifest(
+                    filename=os.path.join(dest, Manifest.Manifest.FILENAME),
+                    source=src)
+                manifest.read()
+                mainSet = FileSet.FileSet(setIter=['a', 'b'], root=src)
+                packageSet = {'pkg': FileSet.FileSet(setIter=packaged,
+                                                     root=src)}
+                rs = Rsync.Rsync(src, dest,
+                                 mainSet=mainSet,
+                                 packageSet=packageSet,
+                                 rsyncBin=rsyncBin,
+                                 manifest=manifest)
+                rs.prepareDest()
+                for name, proc in rs.rsyncAll():
+                    self.assertEqual(proc.returncode, 0)
+                manifest.write()
+                if not os.path.exists(listFile):
+                    return list()
+                with open(listFile) as f:
+                    return sorted(f.read().splitlines())
+
+            self.assertEqual(run(['a']), ['a', 'a', 'b', 'b'])
+            self.assertEqual(run(['a']), [])
+
+            # "b" moves from the orphan to the package bucket.
+            orphan = os.path.join(dest, Rsync.Rsync.ORPHAN,
+                                  Rsync.Rsync.ROOT, 'b')
+            with open(orphan, 'w') as f:
+                f.write('b')
+            self.assertEqual(run(['a', 'b']), ['b'])
+            self.assertFalse(os.path.exists(orphan))
+
+
+if __name__ == '__main__':
+    unittest.main()
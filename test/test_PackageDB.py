@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import os
+
+import purrsync.PackageDB as PackageDB
+import purrsync.FileSet as FileSet
+
+
+class TestPackageDB(unittest.TestCase):
+    def test_gentoo(self):
+        with tempfile.TemporaryDirectory() as dbdir:
+            contents = {
+                'app-shells/bash-5.1_p16-r2': [
+                    'dir /etc',
+                    'dir /etc/bash',
+                    'obj /etc/bash/bashrc 0123456789abcdef 1600000000',
+                    'obj /etc/bash/with space 0123456789abcdef 1600000000',
+                    'sym /bin/sh -> bash 1600000000'],
+                'sys-apps/gtk+-3-3.24': [
+                    'obj /usr/bin/gtk 0123456789abcdef 1600000000']}
+            for pf, lines in contents.items():
+                os.makedirs(os.path.join(dbdir, pf))
+                with open(os.path.join(dbdir, pf, 'CONTENTS'), 'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+
+            pairs = list(PackageDB.readPackages(PackageDB.GENTOO,
+                                                dbdir=dbdir,
+                                                root='/etc',
+                                                jobs=2))
+            self.assertEqual(pairs,
+                             [('app-shells/bash', '/etc'),
+                              ('app-shells/bash', '/etc/bash'),
+                              ('app-shells/bash', '/etc/bash/bashrc'),
+                              ('app-shells/bash', '/etc/bash/with space')])
+
+            pairs = list(PackageDB.readPackages(PackageDB.GENTOO,
+                                                dbdir=dbdir,
+                                                root='/',
+                                                from0=True))
+            self.assertIn(('app-shells/bash', b'/bin/sh'), pairs)
+            self.assertIn(('sys-apps/gtk+-3', b'/usr/bin/gtk'), pairs)
+
+    def test_dpkg(self):
+        with tempfile.TemporaryDirectory() as dbdir:
+            lists = {'bash': ['/.', '/etc', '/etc/bash.bashrc', '/bin/bash'],
+                     'libc6:amd64': ['/.', '/etc', '/etc/ld.so.conf']}
+            for pkg, lines in lists.items():
+                with open(os.path.join(dbdir, pkg + '.list'), 'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+            with open(os.path.join(dbdir, 'bash.md5sums'), 'w') as f:
+                f.write('0123456789abcdef  bin/bash\n')
+
+            ps = FileSet.PackageSource(root='/etc')
+            ps.mapupdate(PackageDB.readPackages(PackageDB.DPKG,
+                                                dbdir=dbdir,
+                                                root='/etc'))
+
+            self.assertEqual(sorted(ps), ['bash', 'libc6:amd64'])
+            self.assertEqual(ps.owners('/etc/ld.so.conf'),
+                             set({'libc6:amd64'}))
+            self.assertNotIn('/bin/bash', ps['bash'])
+            self.assertEqual(ps.shared(),
+                             {'/etc': set({'bash', 'libc6:amd64'})})
+
+    def test_window(self):
+        # Package files are only read up to a window ahead.
+        with tempfile.TemporaryDirectory() as dbdir:
+            def write(i, path):
+                with open(os.path.join(dbdir, 'p{:03d}.list'.format(i)),
+                          'w') as f:
+                    f.write(path + '\n')
+
+            for i in range(100):
+                write(i, '/old')
+            pairs = PackageDB.readPackages(PackageDB.DPKG, dbdir=dbdir,
+                                           jobs=2)
+            self.assertEqual(next(pairs), ('p000', '/old'))
+            for i in range(100):
+                write(i, '/new')
+            paths = [path for pkg, path in pairs]
+            window = 2 * PackageDB.WINDOW
+            self.assertEqual(paths[window - 1:], ['/new'] * (100 - window))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+
+import purrsync.FileSet as FileSet
+import purrsync.FileTrie as FileTrie
+import purrsync.FileBitmap as FileBitmap
+import purrsync.Plan as Plan
+
+
+class TestPlan(unittest.TestCase):
+    def test_expressions(self):
+        mainSet = FileSet.FileSet(setIter=['a', 'b', 'c', 'd.key', 'e'],
+                                  root='/etc')
+        ignoreSet = FileSet.IgnoreSet(setIter=['e'], root='/etc')
+        ignoreSet.addRule('glob:*.key')
+        pkgSet = FileTrie.FileTrie(setIter=['/etc/a', '/etc/d.key',
+                                            '/etc/z'],
+                                   root='/')
+
+        syncPlan = Plan.leaf(mainSet) - ignoreSet
+        self.assertEqual(syncPlan.__set__(), set({'a', 'b', 'c'}))
+        self.assertIn('a', syncPlan)
+        self.assertNotIn('d.key', syncPlan)
+
+        # Operands of another root are re-keyed.
+        pkgPlan = syncPlan & pkgSet
+        self.assertEqual(list(pkgPlan), ['a'])
+        self.assertEqual(pkgPlan.normpath(), set({'/etc/a'}))
+
+        orphanPlan = syncPlan - Plan.Leaf(set({'b'}), mainSet.normroot)
+        self.assertEqual(orphanPlan.__set__(), set({'a', 'c'}))
+        self.assertEqual((orphanPlan | pkgSet).__set__(),
+                         set({'a', 'c', 'd.key', 'z'}))
+
+        # Plans are evaluated lazily.
+        mainSet.add('f')
+        self.assertIn('f', syncPlan.__set__())
+
+        # Plans and nodes are abstract.
+        with self.assertRaises(TypeError):
+            Plan.Plan()
+        with self.assertRaises(TypeError):
+            Plan.Node(syncPlan, pkgPlan)
+
+    def test_bitmap(self):
+        table = FileBitmap.PathTable()
+        mainSet = FileBitmap.FileBitmap(setIter=['a', 'b', 'c', 'd.key'],
+                                        root='/etc', table=table)
+        pkgSet = FileBitmap.FileBitmap(setIter=['a', 'd.key', 'z'],
+                                       root='/etc', table=table)
+        ignoreSet = FileSet.IgnoreSet(root='/etc')
+        ignoreSet.addRule('glob:*.key')
+
+        # Leaves use hasKey, not normalization.
+        self.assertIn('a', Plan.Leaf(mainSet))
+        self.assertIn('a', Plan.Leaf(FileTrie.FileTrie(setIter=['a'])))
+
+        syncPlan = Plan.leaf(mainSet) - ignoreSet
+        self.assertEqual(syncPlan.bitmap()[1],
+                         FileBitmap.bitmap(map(table.ids.get, 'abc')))
+        pkgPlan = syncPlan & pkgSet
+        self.assertIs(pkgPlan.bitmap()[0], table)
+        self.assertEqual(list(pkgPlan), ['a'])
+        self.assertEqual((Plan.leaf(mainSet) - pkgSet).__set__(),
+                         set({'b', 'c'}))
+        self.assertEqual((Plan.leaf(mainSet) | pkgSet).__set__(),
+                         set({'a', 'b', 'c', 'd.key', 'z'}))
+        # Other tables are evaluated by members.
+        otherSet = FileBitmap.FileBitmap(setIter=['b'], root='/etc',
+                                         table=FileBitmap.PathTable())
+        self.assertEqual((syncPlan - otherSet).__set__(), set({'a', 'c'}))
+        self.assertIsNone((syncPlan | otherSet).bitmap())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,177 @@ class TestRsync(unittest.TestCase):
         self.assertEqual(rs1.packageSet, p1)
         self.assertEqual(rs1.rsyncArgs, rA)
 
+    def test_orphanSet(self):
+        mainSet = FileSet.FileSet(setIter=['a', 'b', 'c', 'd'], root='/')
+        ignoreSet = FileSet.FileSet(setIter=['d'], root='/')
+        packageSet = {'pkg1': FileSet.FileSet(setIter=['a'], root='/'),
+                      'pkg2': FileSet.FileSet(setIter=['a', 'b', 'e'],
+                                              root='/')}
+
+        rs1 = Rsync.Rsync(mainSet=mainSet,
+                          ignoreSet=ignoreSet,
+                          packageSet=packageSet)
+
+        self.assertEqual(rs1.syncSet().__set__(), set({'a', 'b', 'c'}))
+        self.assertIs(rs1.syncSet(), rs1.syncSet())
+        self.assertEqual(rs1.orphanSet().__set__(), set({'c'}))
+
+        packageSource = FileSet.PackageSource(root='/')
+        packageSource.mapupdate([('pkg1', 'a'), ('pkg2', 'c')])
+        rs1 = Rsync.Rsync(mainSet=mainSet,
+                          ignoreSet=ignoreSet,
+                          packageSet=packageSource)
+        self.assertEqual(rs1.orphanSet().normpath(), set({'/b'}))
+
+        # Package sets modified directly are excluded too.
+        packageSource = FileSet.PackageSource(root='/')
+        packageSource.add('pkg1').update(['/a'])
+        packageSource['pkg2'] = FileSet.FileSet(setIter=['c'], root='/')
+        rs1 = Rsync.Rsync(mainSet=mainSet,
+                          ignoreSet=ignoreSet,
+                          packageSet=packageSource)
+        self.assertEqual(rs1.orphanSet().normpath(), set({'/b'}))
+
+    def test_jobs(self):
+        """ Tests concurrent transfers with a stub rsync binary. """
+        with tempfile.TemporaryDirectory() as tmp:
+            rsyncBin = os.path.join(tmp, 'rsync')
+            with open(rsyncBin, 'w') as f:
+                f.write('#!/bin/sh\n' +
+                        'case "$*" in *pkg_bad*) exit 23;; esac\n')
+            os.chmod(rsyncBin, 0o755)
+
+            mainSet = FileSet.FileSet(setIter=['a', 'b', 'c'], root='/')
+            packageSet = {
+                'pkg_{}'.format(i): FileSet.FileSet(setIter=['a'], root='/')
+                for i in range(8)}
+            packageSet['pkg_bad'] = FileSet.FileSet(setIter=['b'], root='/')
+
+            rs1 = Rsync.Rsync(destination=tmp,
+                              mainSet=mainSet,
+                              packageSet=packageSet,
+                              rsyncBin=rsyncBin,
+                              jobs=4)
+
+            names = [name for name, proc in rs1.rsyncAll()]
+            self.assertEqual(len(names), len(packageSet) + 2)
+            self.assertEqual(rs1.returncodes[os.path.join(rs1.PACKAGE,
+                                                          'pkg_bad')], 23)
+            self.assertEqual(rs1.returncodes[rs1.MAIN], 0)
+            self.assertEqual(rs1.returncodes[rs1.ORPHAN], 0)
+            self.assertEqual(rs1.stats.spawns, len(packageSet) + 2)
+            self.assertEqual(rs1.stats['rsync/main']['calls'], 1)
+
+            pkgs = {pkg: proc.returncode
+                    for pkg, proc in rs1.rsyncPackages()}
+            self.assertEqual(set(pkgs), set(packageSet))
+            self.assertEqual(pkgs['pkg_bad'], 23)
+
+    def test_link(self):
+        """ Tests linking package and orphan trees from the main tree. """
+        with tempfile.TemporaryDirectory() as dest:
+            mainSet = FileSet.FileSet(setIter=['etc', 'etc/a', 'etc/b'],
+                                      root='/')
+            packageSet = {'pkg1': FileSet.FileSet(setIter=['etc/a'],
+                                                  root='/')}
+            rs1 = Rsync.Rsync(destination=dest,
+                              mainSet=mainSet,
+                              packageSet=packageSet,
+                              rsyncBin='true',
+                              link=Rsync.Rsync.HARDLINK)
+            rs1.prepareDest()
+
+            # Populate the main tree, as rsyncMain would.
+            mainroot = os.path.join(dest, rs1.MAIN, rs1.ROOT)
+            os.mkdir(os.path.join(mainroot, 'etc'))
+            for name in ['a', 'b']:
+                with open(os.path.join(mainroot, 'etc', name), 'w') as f:
+                    f.write(name)
+
+            for pkg, proc in rs1.rsyncPackages():
+                self.assertEqual(proc.returncode, 0)
+            self.assertEqual(rs1.rsyncOrphans().returncode, 0)
+
+            pkgfile = os.path.join(dest, rs1.PACKAGE, 'pkg1', rs1.ROOT,
+                                   'etc', 'a')
+            orpfile = os.path.join(dest, rs1.ORPHAN, rs1.ROOT, 'etc', 'b')
+            self.assertTrue(os.path.samefile(
+                pkgfile, os.path.join(mainroot, 'etc', 'a')))
+            self.assertTrue(os.path.samefile(
+                orpfile, os.path.join(mainroot, 'etc', 'b')))
+            self.assertFalse(os.path.exists(
+                os.path.join(dest, rs1.ORPHAN, rs1.ROOT, 'etc', 'a')))
+
+            # Relinking is idempotent
+            self.assertEqual(rs1.rsyncOrphans().returncode, 0)
+
+            # Temporary links of an interrupted run are replaced.
+            os.remove(pkgfile)
+            with open(Rsync.tmpPath(pkgfile), 'w') as f:
+                f.write('stale')
+            for pkg, proc in rs1.rsyncPackages():
+                self.assertEqual(proc.returncode, 0)
+            self.assertTrue(os.path.samefile(
+                pkgfile, os.path.join(mainroot, 'etc', 'a')))
+            self.assertFalse(os.path.lexists(Rsync.tmpPath(pkgfile)))
+
+            # Keys outside root are never linked outside dest.
+            proc, count = rs1.linkPaths(['/etc/a', '../etc/a'],
+                                        os.path.join(dest, 'other'))
+            self.assertEqual(proc.returncode, 1)
+            self.assertFalse(os.path.exists(os.path.join(dest, 'other')))
+
+    def test_filesFrom(self):
+        """ Tests the file list is streamed to rsync's stdin. """
+        with tempfile.TemporaryDirectory() as tmp:
+            rsyncBin = os.path.join(tmp, 'rsync')
+            listFile = os.path.join(tmp, 'list')
+            argsFile = os.path.join(tmp, 'args')
+            with open(rsyncBin, 'w') as f:
+                f.write('#!/bin/sh\n' +
+                        'echo "$@" > {}\n'.format(argsFile) +
+                        'cat > {}\n'.format(listFile))
+            os.chmod(rsyncBin, 0o755)
+
+            fileList = ['file{}'.format(i) for i in range(10000)]
+            rs1 = Rsync.Rsync(destination=tmp,
+                              mainSet=FileSet.FileSet(setIter=fileList,
+                                                      root='/'),
+                              rsyncBin=rsyncBin)
+            self.assertEqual(rs1.rsyncMain().returncode, 0)
+
+            with open(argsFile) as f:
+                self.assertIn('--files-from=-', f.read().split())
+            with open(listFile) as f:
+                self.assertEqual(sorted(f.read().splitlines()),
+                                 sorted(fileList))
+
+    def test_transferStats(self):
+        """ Tests rsync output is parsed into Transfer records. """
+        with tempfile.TemporaryDirectory() as tmp:
+            rsyncBin = os.path.join(tmp, 'rsync')
+            with open(rsyncBin, 'w') as f:
+                f.write('#!/bin/sh\n' +
+                        'sed "s/^/>f+++++++++ /"\n' +
+                        'echo "Total bytes sent: 1,234"\n' +
+                        'echo "total size is 10  speedup is 0.01"\n')
+            os.chmod(rsyncBin, 0o755)
+
+            fileList = ['file{}'.format(i) for i in range(10000)]
+            rs1 = Rsync.Rsync(destination=tmp,
+                              mainSet=FileSet.FileSet(setIter=fileList,
+                                                      root='/'),
+                              rsyncBin=rsyncBin,
+                              transferStats=True)
+            self.assertEqual(rs1.rsyncMain().returncode, 0)
+
+            transfer = rs1.transfers[rs1.MAIN]
+            self.assertEqual(transfer['paths'], len(fileList))
+            self.assertEqual(transfer['itemized'], len(fileList))
+            self.assertEqual(transfer['bytes_sent'], 1234)
+            self.assertEqual(transfer['speedup'], 0.01)
+            self.assertEqual(transfer['exit'], 0)
+
     def test_which(self):
         rs1 = Rsync.Rsync()
         self.assertEqual(rs1.which(), "/usr/bin/rsync")
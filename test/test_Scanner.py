@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import os
+
+import purrsync.Scanner as Scanner
+import purrsync.FileSet as FileSet
+
+
+class TestScanner(unittest.TestCase):
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as src:
+            for path in ['a.conf', 'b.key', 'sub/c.conf', 'sub/deep/d.key',
+                         'skip/e.conf']:
+                os.makedirs(os.path.dirname(os.path.join(src, path)),
+                            exist_ok=True)
+                with open(os.path.join(src, path), 'w') as f:
+                    f.write(path)
+            os.symlink(os.path.join(src, 'sub'), os.path.join(src, 'link'))
+
+            for jobs in [1, 4]:
+                mainSet = FileSet.FileSet(root=src)
+                ignoreSet = FileSet.FileSet(root=src)
+                Scanner.scan(src, mainSet, ignoreSet,
+                             exclude=['*.key', 'skip/*'],
+                             jobs=jobs)
+                self.assertEqual(mainSet.__set__(),
+                                 set({'a.conf', 'sub', 'sub/c.conf',
+                                      'sub/deep', 'skip', 'link'}))
+                self.assertEqual(ignoreSet.__set__(),
+                                 set({'b.key', 'sub/deep/d.key',
+                                      'skip/e.conf'}))
+
+            mainSet = FileSet.FileSet(root=src)
+            ignoreSet = FileSet.IgnoreSet(root=src)
+            ignoreSet.addRule('sub/deep/')
+            ignoreSet.addRule('glob:*.key')
+            Scanner.scan(src, mainSet, ignoreSet, jobs=2)
+            self.assertNotIn('sub/deep', mainSet)
+            self.assertNotIn('sub/deep/d.key', mainSet)
+            self.assertEqual((mainSet - ignoreSet).__set__(),
+                             set({'a.conf', 'sub', 'sub/c.conf', 'skip',
+                                  'skip/e.conf', 'link'}))
+
+            mainSet = FileSet.FileSet(root=src, from0=True)
+            Scanner.scan(src, mainSet, include=['*.conf'])
+            self.assertEqual(mainSet.__set__(),
+                             set({b'a.conf', b'sub/c.conf', b'skip/e.conf'}))
+
+    def test_scanMissing(self):
+        errors = list()
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, 'missing')
+            for jobs in [1, 2]:
+                mainSet = FileSet.FileSet(root=src)
+                with self.assertRaises(OSError):
+                    Scanner.scan(src, mainSet, jobs=jobs,
+                                 onerror=errors.append)
+        self.assertEqual(errors, list())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import json
+import concurrent.futures as cf
+
+import purrsync.Stats as Stats
+
+
+class TestStats(unittest.TestCase):
+    def test_phase(self):
+        stats = Stats.Stats()
+        for i in range(2):
+            with stats.phase('main') as counts:
+                counts['paths'] = 10
+        with self.assertRaises(KeyError):
+            with stats.phase('failed'):
+                raise KeyError()
+
+        self.assertEqual(stats['main']['calls'], 2)
+        self.assertEqual(stats['main']['paths'], 20)
+        self.assertGreaterEqual(stats['main']['wall'], 0)
+        self.assertEqual(stats['failed']['calls'], 1)
+        self.assertEqual(stats['main']['spawns'], 0)
+        self.assertGreater(stats['main']['maxrss'], 0)
+
+        def transfer(i):
+            with stats.phase('rsync'):
+                stats.spawned()
+
+        with cf.ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(transfer, range(16)))
+        self.assertEqual(stats['rsync']['calls'], 16)
+        self.assertEqual(stats.spawns, 16)
+        self.assertGreaterEqual(stats['rsync']['spawns'], 16)
+
+        with stats.phase('package/update'):
+            stats.spawned(3)
+        self.assertEqual(stats['package/update']['spawns'], 3)
+
+    def test_write(self):
+        stats = Stats.Stats()
+        with stats.phase('main'):
+            pass
+        with tempfile.NamedTemporaryFile(mode='r') as fp:
+            stats.write(fp.name)
+            report = json.load(fp)
+        self.assertEqual(set(report['phases']), set({'main'}))
+        for key in ['wall', 'cpu', 'spawns', 'maxrss', 'maxrss_children']:
+            self.assertIn(key, report)
+        self.assertGreater(report['maxrss'], 0)
+        for key in ['calls', 'wall', 'cpu', 'paths', 'spawns', 'maxrss',
+                    'maxrss_children']:
+            self.assertIn(key, report['phases']['main'])
+
+
+if __name__ == '__main__':
+    unittest.main()
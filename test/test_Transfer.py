@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Roger Welsh <rjhwelsh@gmail.com>
+
+import unittest
+import tempfile
+import json
+
+import purrsync.Transfer as Transfer
+
+OUTPUT = """>f+++++++++ etc/fstab
+cd+++++++++ etc/conf.d/
+.f..t...... etc/hosts
+
+Number of files: 3 (reg: 2, dir: 1)
+Number of regular files transferred: 2
+Total file size: 1,234 bytes
+Total transferred file size: 1,000 bytes
+Literal data: 1,000 bytes
+Total bytes sent: 1,456
+Total bytes received: 57
+
+sent 1,456 bytes  received 57 bytes  3,026.00 bytes/sec
+total size is 1,234  speedup is 0.82
+""".splitlines()
+
+
+class TestTransfer(unittest.TestCase):
+    def test_parse(self):
+        transfer = Transfer.Transfer('pkg/sys-apps/baselayout',
+                                     returncode=0,
+                                     duration=1.5,
+                                     paths=3,
+                                     output=OUTPUT)
+        self.assertEqual(transfer['bucket'], 'pkg')
+        self.assertEqual(transfer['package'], 'sys-apps/baselayout')
+        self.assertEqual(transfer['itemized'], 3)
+        self.assertEqual(transfer['files'], 2)
+        self.assertEqual(transfer['total_size'], 1234)
+        self.assertEqual(transfer['transferred_size'], 1000)
+        self.assertEqual(transfer['bytes_sent'], 1456)
+        self.assertEqual(transfer['bytes_received'], 57)
+        self.assertEqual(transfer['speedup'], 0.82)
+
+        transfer = Transfer.Transfer('main', returncode=23)
+        self.assertEqual(transfer['bucket'], 'main')
+        self.assertIsNone(transfer['package'])
+        self.assertEqual(transfer['files'], 0)
+        self.assertEqual(transfer['exit'], 23)
+
+    def test_summary(self):
+        transfers = [Transfer.Transfer('main', duration=1.0,
+                                       output=OUTPUT),
+                     Transfer.Transfer('pkg/a/b', duration=3.0,
+                                       output=OUTPUT),
+                     Transfer.Transfer('pkg/a/c', returncode=23,
+                                       duration=2.0)]
+        summary = Transfer.summary(transfers, top=2)
+        self.assertEqual(summary['buckets']['pkg']['transfers'], 2)
+        self.assertEqual(summary['buckets']['pkg']['files'], 2)
+        self.assertEqual(summary['buckets']['total']['bytes_sent'], 2912)
+        self.assertEqual(summary['buckets']['total']['duration'], 6.0)
+        self.assertEqual(summary['failed'], ['pkg/a/c'])
+        self.assertEqual([t['name'] for t in summary['slowest']],
+                         ['pkg/a/b', 'pkg/a/c'])
+
+        with tempfile.NamedTemporaryFile(mode='r') as fp:
+            Transfer.write(fp.name, transfers)
+            report = json.load(fp)
+        self.assertEqual(set(report['transfers']),
+                         set({'main', 'pkg/a/b', 'pkg/a/c'}))
+        self.assertEqual(report['transfers']['main']['files'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()